@@ -8,27 +8,293 @@ CC-Share Alike 2012 © The Wyrd In team
 https://github.com/WyrdIn
 
 """
+from datetime import datetime
+import os.path
+import threading
+
+
+def time_to_epoch(dt):
+    """Represents a datetime for storage as a pair (UTC epoch seconds, name of
+    the timezone). Returns (None, None) for None.
+
+    """
+    if dt is None:
+        return None, None
+    return int(dt.timestamp()), getattr(dt.tzinfo, 'zone', None)
+
+
+def time_from_epoch(epoch, zone):
+    """Inverse to `time_to_epoch'. Zones without a name are read back as
+    UTC.
+
+    """
+    if epoch is None:
+        return None
+    return datetime.fromtimestamp(epoch, zone_by_name(zone))
+
+
+def time_us_from_epoch(epoch, zone):
+    """Like `time_from_epoch', but returns the pair (microseconds since the
+    epoch, timezone object), the way worktime.Interval keeps times, without
+    building a datetime. Returns (None, None) for None.
+
+    """
+    if epoch is None:
+        return None, None
+    return epoch * 1000000, zone_by_name(zone)
+
+
+# Timezone objects by their names, as looked up by `zone_by_name'.
+_zones = {}
+
+
+def zone_by_name(zone):
+    """Returns the timezone object for the name `zone' (UTC for None)."""
+    try:
+        return _zones[zone]
+    except KeyError:
+        import pytz
+        tzinfo = _zones[zone] = pytz.timezone(zone or 'UTC')
+        return tzinfo
+
+
+def task_link_refs(task):
+    """Represents the links of a task to other objects for storage as a pair
+    (prerequisites, enables), where `prerequisites' is the short_repr of the
+    task's prerequisites (or None) and `enables' is the list of short_reprs
+    of soes the task enables.
+
+    """
+    prereqs = getattr(task, 'prerequisites', None)
+    return ((None if prereqs is None else prereqs.short_repr()),
+            [soe.short_repr() for soe in getattr(task, 'enables', None) or ()])
+
+
+def resolve_task_links(links, tasks, groups):
+    """Sets prerequisites and the `enables' lists of tasks from references
+    read from storage. References to objects not known are dropped.
+
+    Keyword arguments:
+        - links: a mapping of tasks to pairs (prerequisites, enables), as
+                 returned by `task_link_refs'
+        - tasks: a mapping of known task IDs to the corresponding task
+                 objects
+        - groups: a mapping of short_reprs to all known groupings, including
+                  nested ones
+
+    """
+    def resolve(ref):
+        if ref in groups:
+            return groups[ref]
+        if ref.startswith('t') and ref[1:].isdigit():
+            return tasks.get(int(ref[1:]))
+        return None
+
+    for task, (prereqs_ref, enables_refs) in links.items():
+        if prereqs_ref:
+            prereqs = resolve(prereqs_ref)
+            if prereqs is not None:
+                task.prerequisites = prereqs
+        enables = [soe for soe in map(resolve, enables_refs or ())
+                   if soe is not None]
+        if enables:
+            task.enables = enables
+
+
+class IdAllocator(object):
+    """Allocates IDs for DBObjects, separately for each class.
+
+    For each class, the allocator tracks the high-water mark of IDs -- a
+    number above any ID in use -- and keeps it in a file next to the data
+    files. That way new objects get IDs that do not collide with IDs of
+    objects which have not been loaded.
+
+    IDs are reserved from the high-water mark in blocks of BLOCK_SIZE, each
+    thread drawing from a block of its own, so that threads creating objects
+    contend only when reserving a block.
+
+    """
+    BLOCK_SIZE = 64
+
+    def __init__(self):
+        self.fname = None
+        self._lock = threading.Lock()
+        self._saved = {}  # class name -> high-water mark in the file
+        self._used = {}  # class name -> 1 + the highest ID used explicitly
+        self._reserved = {}  # class name -> 1 + the highest ID reserved
+        # (class name, thread ID) -> [next ID, end of the block]
+        self._blocks = {}
+
+    def open(self, fname):
+        """Starts keeping the high-water marks in the file `fname', reading
+        them from the file if it exists.
+
+        """
+        marks = {}
+        if os.path.exists(fname):
+            import json
+            with open(fname, encoding='UTF-8') as infile:
+                marks = json.load(infile)
+        with self._lock:
+            self.fname = fname
+            self._saved = marks
+            for name, mark in marks.items():
+                self._used[name] = max(self._used.get(name, 0), mark)
+
+    def observe(self, cls, id):
+        """Records that an object of the class `cls' uses the ID `id'."""
+        name = cls.__name__
+        with self._lock:
+            if id >= self._used.get(name, 0):
+                self._used[name] = id + 1
+
+    def allocate(self, cls):
+        """Returns a new ID for an object of the class `cls'."""
+        name = cls.__name__
+        key = (name, threading.get_ident())
+        block = self._blocks.get(key)
+        # Only this thread uses the block. An ID from the block can have been
+        # used explicitly since the block was reserved, though, in which case
+        # the rest of the block is dropped.
+        if (block is None or block[0] == block[1]
+                or block[0] < self._used.get(name, 0)):
+            with self._lock:
+                start = max(self._used.get(name, 0),
+                            self._reserved.get(name, 0))
+                self._reserved[name] = start + self.BLOCK_SIZE
+                block = self._blocks[key] = [start, start + self.BLOCK_SIZE]
+        id = block[0]
+        block[0] += 1
+        return id
+
+    def marks(self):
+        """Returns the high-water marks of IDs, as a dictionary from class
+        names to the marks.
+
+        """
+        with self._lock:
+            marks = dict(self._used)
+            for (name, _), (next_id, _) in self._blocks.items():
+                marks[name] = max(marks.get(name, 0), next_id)
+        return marks
+
+    def save(self):
+        """Writes the high-water marks to the file, if they have changed
+        since the file was read or written.
+
+        """
+        marks = self.marks()
+        if self.fname is None or marks == self._saved:
+            return
+        import json
+        from util import open_atomic
+        with open_atomic(self.fname, 'w', encoding='UTF-8') as outfile:
+            json.dump(marks, outfile, indent=1, sort_keys=True)
+        self._saved = marks
+
+
+# The allocator of IDs for all DBObjects.
+id_allocator = IdAllocator()
 
 
 class DBObject(object):
-    _next_id = 0
+    # Objects keep their attributes in slots rather than in a __dict__.
+    # Attributes that have not been set raise AttributeError, as they did
+    # with a __dict__. The `_id' slot is declared by the subclasses, since
+    # WorkSlot has another base class with slots, Interval.
+    __slots__ = ()
+    # Slots holding data derived from other objects, which are not pickled.
+    _derived = ()
+    # Number of modifications (mostly attribute assignments) done on objects
+    # of each class, to tell whether any objects have been modified since
+    # some point in time.
+    _modifications = {}
+    # Objects modified since `track_modified' or `take_modified' was last
+    # called, by their id(); None if modified objects are not tracked.
+    _modified_objs = None
+
+    def __setattr__(self, name, value):
+        self._count_modification()
+        super().__setattr__(name, value)
+
+    def _count_modification(self):
+        """Counts a modification of the object. Subclasses call this for
+        modifications done other than by setting attributes.
+
+        """
+        cls = type(self)
+        DBObject._modifications[cls] = DBObject._modifications.get(cls, 0) + 1
+        if DBObject._modified_objs is not None:
+            DBObject._modified_objs[id(self)] = self
+
+    @staticmethod
+    def track_modified():
+        """Starts recording which objects get modified (including objects
+        created), for backends that write only the objects changed.
+
+        """
+        DBObject._modified_objs = {}
+
+    @staticmethod
+    def take_modified():
+        """Returns the list of objects modified since `track_modified' or this
+        method was last called, or None if modified objects are not tracked.
+
+        """
+        if DBObject._modified_objs is None:
+            return None
+        objs = list(DBObject._modified_objs.values())
+        DBObject._modified_objs = {}
+        return objs
+
+    @classmethod
+    def modifications(cls):
+        """Returns how many times attributes have been set on objects of this
+        class (including its subclasses) so far.
+
+        """
+        return sum(count for klass, count in DBObject._modifications.items()
+                   if issubclass(klass, cls))
 
     def __init__(self, id=None):
         """Creates a new database-enabled object.
 
         Keyword arguments:
             - id: an ID (a number) of the object, if a specific one is
-                  required; if ID is supplied, it has to be non-negative
-                  integer larger than any of IDs for this type of object
-                  assigned so far
+                  required, such as when the object is being loaded from
+                  disk; if ID is supplied, it has to be a non-negative
+                  integer not assigned to any other object of this type
 
         """
         cls = type(self)  # the actual (most specific) class of self
-        if id is not None and id >= cls._next_id:
-            self._id = id
+        if id is None:
+            id = id_allocator.allocate(cls)
         else:
-            self._id = cls._next_id
-        cls._next_id = self._id + 1
+            # Objects may be loaded in any order (e.g. when only a part of the
+            # log is read at a time), so IDs supplied may be lower than ones
+            # assigned already.
+            id_allocator.observe(cls, id)
+        self._id = id
+
+    def __getstate__(self):
+        state = {}
+        for klass in type(self).__mro__:
+            for name in klass.__dict__.get('__slots__', ()):
+                if name not in self._derived and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        """Restores the object from a pickled state, which can also be
+        a dictionary of attributes, as pickled before the classes used
+        slots.
+
+        """
+        if isinstance(state, tuple):
+            dict_state, slots_state = state
+            state = dict(dict_state or {}, **(slots_state or {}))
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
 
     @property
     def id(self):
@@ -0,0 +1,365 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+# This code is PEP8-compliant. See http://www.python.org/dev/peps/pep-0008/.
+"""
+
+Wyrd In: Time tracker and task manager
+CC-Share Alike 2012 © The Wyrd In team
+https://github.com/WyrdIn
+
+This module implements an append-only journal storage for tasks, groupings
+and work slots. Each change to the user's data is recorded as one line of
+JSON at the end of the journal; the current state is obtained by replaying
+the journal from its beginning. From time to time, the journal is compacted
+into a snapshot which holds just one record per live object.
+
+"""
+from datetime import timedelta
+import json
+import os.path
+
+from backend.generic import (DBObject, resolve_task_links, task_link_refs,
+                             time_from_epoch, time_to_epoch,
+                             time_us_from_epoch)
+from grouping import SoeGrouping, AndGroup, OrGroup, ListGroup
+from task import Task
+from util import open_atomic
+
+
+class JournalBackend(object):
+    """Reads and writes user's data from/to a journal file.
+
+    Unlike the other backends, a journal backend has a state -- it remembers
+    what the journal says about each object, so that only records for
+    objects that changed are appended on writing. Once the journal has been
+    read or written, only objects modified since (as tracked by DBObject)
+    are serialised to find out which ones changed.
+
+    """
+    # The journal is compacted as soon as it holds more than
+    # COMPACT_RATIO times as many records as there are live objects (and at
+    # least COMPACT_MIN records).
+    COMPACT_RATIO = 4
+    COMPACT_MIN = 1024
+
+    _typestr2cls = {'and': AndGroup,
+                    'or': OrGroup,
+                    'list': ListGroup}
+
+    def __init__(self, fname):
+        """Creates a backend for the journal in the file `fname'."""
+        self.fname = fname
+        self._records = {}  # short_repr -> serialised record
+        self._nrecords = 0  # number of records in the journal file
+        # Whether the journal ends with an incomplete line, left by a crash
+        # while appending, which has to be dropped before appending more.
+        self._torn = False
+        # Numbers of records of each kind of objects (see `_kind').
+        self._counts = {'task': 0, 'group': 0, 'slot': 0}
+        # short_repr of a grouping -> whether it is recorded as a top-level
+        # one.
+        self._group_tops = {}
+        # Whether `_records' reflect the data as of the last time modified
+        # objects were taken from DBObject.
+        self._synced = False
+
+    @staticmethod
+    def _kind(key):
+        """Returns the kind of object ('task', 'group' or 'slot') described
+        by the record for the short_repr `key'.
+
+        """
+        if key.startswith('ws'):
+            return 'slot'
+        if key.startswith('t') and key[1:].isdigit():
+            return 'task'
+        return 'group'
+
+    @classmethod
+    def _task_rec(cls, task):
+        rec = {'op': 'task',
+               'id': task.id,
+               'name': task.name,
+               'project': task.project,
+               'done': task.done}
+        if hasattr(task, 'time'):
+            rec['time'] = task.time.total_seconds()
+        if getattr(task, 'deadline', None) is not None:
+            rec['deadline'], rec['deadline_tz'] = time_to_epoch(
+                task.deadline)
+        prereqs, enables = task_link_refs(task)
+        if prereqs is not None:
+            rec['prerequisites'] = prereqs
+        if enables:
+            rec['enables'] = enables
+        return rec
+
+    @classmethod
+    def _group_rec(cls, group, top):
+        return {'op': 'group',
+                'id': group.short_repr(),
+                'type': type(group).name,
+                'top': top,
+                'elems': [member.short_repr() for member in group.elems]}
+
+    @classmethod
+    def _slot_rec(cls, slot):
+        rec = {'op': 'slot',
+               'id': slot.id,
+               'task': slot.task.id}
+        rec['start'], rec['start_tz'] = time_to_epoch(slot.start)
+        rec['end'], rec['end_tz'] = time_to_epoch(slot.end)
+        return rec
+
+    @staticmethod
+    def _dumps(rec):
+        return json.dumps(rec, sort_keys=True, ensure_ascii=False)
+
+    def _current_records(self, tasks, groups, slots):
+        """Serialises the current data into records, keyed by short_repr of
+        the object they describe.
+
+        """
+        records = {}
+        for task in tasks:
+            records[task.short_repr()] = self._dumps(self._task_rec(task))
+        # Record all groups reachable from the top-level ones.
+        top_groups = set(groups)
+        to_visit = list(groups)
+        seen = set()
+        while to_visit:
+            group = to_visit.pop()
+            if group in seen:
+                continue
+            seen.add(group)
+            records[group.short_repr()] = self._dumps(
+                self._group_rec(group, group in top_groups))
+            to_visit.extend(member for member in group.elems
+                            if isinstance(member, SoeGrouping))
+        for slot in slots:
+            records[slot.short_repr()] = self._dumps(self._slot_rec(slot))
+        return records
+
+    def read(self):
+        """Replays the journal.
+
+        Returns a tuple (tasks, groups, slots) describing the current state.
+
+        """
+        from worktime import WorkSlot
+        records = {}
+        nrecords = 0
+        torn = None  # the error decoding the last record read, if any
+        complete = True  # whether the last line read ends with a newline
+        if os.path.exists(self.fname):
+            with open(self.fname, encoding='UTF-8') as infile:
+                for line in infile:
+                    if torn is not None and line.strip():
+                        # Only the last line can be incomplete.
+                        raise torn
+                    complete = line.endswith('\n')
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except ValueError as error:
+                        # A crash while appending can leave the last line
+                        # incomplete. The record is dropped.
+                        torn = error
+                        continue
+                    nrecords += 1
+                    if rec['op'] == 'remove':
+                        records.pop(rec['id'], None)
+                    else:
+                        key = rec['id']
+                        if rec['op'] == 'task':
+                            key = 't{id}'.format(id=key)
+                        elif rec['op'] == 'slot':
+                            key = 'ws{id}'.format(id=key)
+                        records[key] = line
+        self._records = records
+        self._nrecords = nrecords
+        self._torn = torn is not None or not complete
+
+        # Build the objects.
+        tasks = []
+        tasks_map = {}  # task ID -> task
+        groups = []
+        groups_map = {}  # short_repr -> group
+        group_recs = []
+        links = {}  # task -> references to its prerequisites and enables
+        slots = []
+        slot_recs = []
+        counts = {'task': 0, 'group': 0, 'slot': 0}
+        self._group_tops = {}
+        for line in records.values():
+            rec = json.loads(line)
+            counts[rec['op']] += 1
+            if rec['op'] == 'task':
+                task = Task(name=rec['name'],
+                            project=rec['project'],
+                            id=rec['id'])
+                task.done = rec['done']
+                if 'time' in rec:
+                    task.time = timedelta(seconds=rec['time'])
+                if 'deadline' in rec:
+                    task.deadline = time_from_epoch(rec['deadline'],
+                                                    rec['deadline_tz'])
+                tasks.append(task)
+                tasks_map[task.id] = task
+                links[task] = (rec.get('prerequisites'),
+                               rec.get('enables', []))
+            elif rec['op'] == 'group':
+                group = self._typestr2cls[rec['type']](short_repr=rec['id'])
+                groups_map[rec['id']] = group
+                self._group_tops[rec['id']] = rec['top']
+                group_recs.append((group, rec))
+            else:
+                slot_recs.append(rec)
+        # Groups may refer to groups recorded later, so members are resolved
+        # only after all groups have been created. Members not known (tasks
+        # removed since, for one) are dropped.
+        for group, rec in group_recs:
+            members = []
+            for member in rec['elems']:
+                if member in groups_map:
+                    members.append(groups_map[member])
+                elif member.startswith('t') and member[1:].isdigit():
+                    task = tasks_map.get(int(member[1:]))
+                    if task is not None:
+                        members.append(task)
+            group.elems = members
+            if rec['top']:
+                groups.append(group)
+        resolve_task_links(links, tasks_map, groups_map)
+        for rec in slot_recs:
+            slots.append(WorkSlot.from_us(
+                tasks_map[rec['task']],
+                *(time_us_from_epoch(rec['start'], rec['start_tz'])
+                  + time_us_from_epoch(rec['end'], rec['end_tz'])),
+                id=rec['id']))
+        self._counts = counts
+        # Changes from now on are tracked, to be written.
+        self._synced = True
+        DBObject.track_modified()
+        return tasks, groups, slots
+
+    def _all_changes(self, tasks, groups, slots):
+        """Returns the changes of records needed to describe the current
+        data, as a dictionary from short_reprs of objects to their new
+        records (None for objects removed), comparing all objects with the
+        records.
+
+        """
+        records = self._current_records(tasks, groups, slots)
+        changes = dict((key, line) for key, line in records.items()
+                       if self._records.get(key) != line)
+        changes.update((key, None) for key in self._records
+                       if key not in records)
+        return changes
+
+    def _changes(self, tasks, groups, slots, modified):
+        """Like `_all_changes', but serialises only the objects `modified'
+        since the records were last brought up to date. All tasks or work
+        slots are looked at only if their number shows that some have been
+        removed (or that objects not held have been modified).
+
+        """
+        from worktime import WorkSlot
+        changes = {}
+        for kind, cls, objs, to_rec in (('task', Task, tasks, self._task_rec),
+                                        ('slot', WorkSlot, slots,
+                                         self._slot_rec)):
+            changed = {}  # short_repr -> object modified
+            for obj in modified:
+                if isinstance(obj, cls):
+                    changed[obj.short_repr()] = obj
+            nnew = sum(1 for key in changed if key not in self._records)
+            if len(objs) != self._counts[kind] + nnew:
+                live = set(obj.short_repr() for obj in objs)
+                changes.update((key, None) for key in self._records
+                               if self._kind(key) == kind and key not in live)
+                changed = dict((key, obj) for key, obj in changed.items()
+                               if key in live)
+            for key, obj in changed.items():
+                line = self._dumps(to_rec(obj))
+                if self._records.get(key) != line:
+                    changes[key] = line
+        # Groupings are few, so all of those reachable from the top-level
+        # ones are visited, to find out which ones are live and top-level.
+        modified_ids = set(id(obj) for obj in modified
+                           if isinstance(obj, SoeGrouping))
+        top_groups = set(groups)
+        live = set()
+        to_visit = list(groups)
+        seen = set()
+        while to_visit:
+            group = to_visit.pop()
+            if group in seen:
+                continue
+            seen.add(group)
+            key = group.short_repr()
+            live.add(key)
+            top = group in top_groups
+            if id(group) in modified_ids or self._group_tops.get(key) != top:
+                line = self._dumps(self._group_rec(group, top))
+                if self._records.get(key) != line:
+                    changes[key] = line
+            to_visit.extend(member for member in group.elems
+                            if isinstance(member, SoeGrouping))
+        changes.update((key, None) for key in self._group_tops
+                       if key not in live)
+        return changes
+
+    def write(self, tasks, groups, slots):
+        """Appends records for objects that changed since the journal was last
+        read or written to the journal. Compacts the journal if it has grown
+        too long.
+
+        """
+        modified = DBObject.take_modified() if self._synced else None
+        if modified is None:
+            changes = self._all_changes(tasks, groups, slots)
+            DBObject.track_modified()
+        else:
+            changes = self._changes(tasks, groups, slots, modified)
+        records = self._records
+        new_lines = []
+        for key, line in changes.items():
+            kind = self._kind(key)
+            if line is None:
+                del records[key]
+                self._counts[kind] -= 1
+                new_lines.append(self._dumps({'op': 'remove', 'id': key}))
+            else:
+                if key not in records:
+                    self._counts[kind] += 1
+                records[key] = line
+                new_lines.append(line)
+            if kind == 'group':
+                if line is None:
+                    del self._group_tops[key]
+                else:
+                    self._group_tops[key] = json.loads(line)['top']
+        self._synced = True
+        # An incomplete last line is dropped by rewriting the journal.
+        if (self._torn or self._nrecords + len(new_lines)
+                > max(self.COMPACT_MIN, self.COMPACT_RATIO * len(records))):
+            self.compact()
+        elif new_lines:
+            with open(self.fname, 'a', encoding='UTF-8') as outfile:
+                for line in new_lines:
+                    outfile.write(line + '\n')
+            self._nrecords += len(new_lines)
+
+    def compact(self):
+        """Rewrites the journal as a snapshot holding one record per live
+        object.
+
+        """
+        with open_atomic(self.fname, 'w', encoding='UTF-8') as outfile:
+            for line in self._records.values():
+                outfile.write(line + '\n')
+        self._nrecords = len(self._records)
+        self._torn = False
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+# This code is PEP8-compliant. See http://www.python.org/dev/peps/pep-0008/.
+"""
+
+Wyrd In: Time tracker and task manager
+CC-Share Alike 2012 © The Wyrd In team
+https://github.com/WyrdIn
+
+This module implements a log of work slots split into XML files by calendar
+months, e.g. `log/2012-12.xml'. A slot belongs to the month (in UTC) of its
+start, so that its partition does not depend on its timezone and agrees with
+the UTC time bounds kept for the partitions. A manifest in the same directory
+records time bounds and the number of slots of each partition, so that only
+partitions intersecting the time in question need to be read, and only
+partitions holding changed slots need to be rewritten.
+
+"""
+import json
+import os
+import os.path
+import time
+
+from backend.generic import time_to_epoch
+from backend.xml import XmlBackend
+from util import open_atomic, open_backed_up
+
+
+class XmlMonthlyLog(object):
+    """A log of work slots partitioned into XML files by months."""
+    MANIFEST_FNAME = 'manifest.json'
+    UNDATED = 'undated'  # the partition for slots without start time
+
+    def __init__(self, dirname, backup_suffix='~'):
+        """Opens the log stored in the directory `dirname'."""
+        self.dirname = dirname
+        self.backup_suffix = backup_suffix
+        # partition name -> {'start': .., 'end': .., 'count': ..}, with start
+        # and end being the UTC epoch time bounds of slots in the partition
+        # (None meaning unbounded)
+        self.manifest = {}
+        manifest_fname = os.path.join(dirname, self.MANIFEST_FNAME)
+        if os.path.exists(manifest_fname):
+            with open(manifest_fname, encoding='UTF-8') as manifest_file:
+                self.manifest = json.load(manifest_file)
+        self._loaded = set()  # names of partitions read
+        self._slot_rows = {}  # ID of a slot read -> (partition, row)
+
+    @classmethod
+    def partition_of(cls, slot):
+        """Returns the name of the partition the work slot belongs to, named
+        by the UTC month of its start.
+
+        """
+        if slot.start is None:
+            return cls.UNDATED
+        return time.strftime('%Y-%m',
+                             time.gmtime(time_to_epoch(slot.start)[0]))
+
+    @staticmethod
+    def _slot_row(slot):
+        return ((slot.task.id, )
+                + time_to_epoch(slot.start)
+                + time_to_epoch(slot.end))
+
+    def _partition_fname(self, partition):
+        return os.path.join(self.dirname, '{}.xml'.format(partition))
+
+    @property
+    def complete(self):
+        """Whether all partitions have been read."""
+        return self._loaded.issuperset(self.manifest)
+
+    def _read_partition(self, partition, tasks):
+        with open(self._partition_fname(partition), 'rb') as infile:
+            slots = XmlBackend.read_workslots(infile, tasks)
+        self._loaded.add(partition)
+        for slot in slots:
+            self._slot_rows[slot.id] = (partition, self._slot_row(slot))
+        return slots
+
+    def read_slots(self, tasks, invl=None):
+        """Reads work slots from partitions that intersect the Interval `invl'
+        and that have not been read yet.
+
+        Keyword arguments:
+            - tasks: a mapping of known task IDs to the corresponding task
+                     objects
+            - invl: the time window to read slots from (default: everything)
+
+        """
+        invl_start, invl_end = ((None, None) if invl is None
+                                else (time_to_epoch(invl.start)[0],
+                                      time_to_epoch(invl.end)[0]))
+        slots = []
+        for partition in sorted(self.manifest):
+            if partition in self._loaded:
+                continue
+            bounds = self.manifest[partition]
+            if ((bounds['start'] is None or invl_end is None
+                 or bounds['start'] <= invl_end)
+                    and (bounds['end'] is None or invl_start is None
+                         or bounds['end'] >= invl_start)):
+                slots.extend(self._read_partition(partition, tasks))
+        return slots
+
+    @property
+    def max_id(self):
+        """The maximum ID of any work slot (-1 if there are none)."""
+        return max((bounds.get('max_id', -1)
+                    for bounds in self.manifest.values()),
+                   default=-1)
+
+    def write_slots(self, slots, tasks):
+        """Rewrites partitions that hold work slots changed since they were
+        read, and updates the manifest.
+
+        Partitions that have to be rewritten but have not been read are read
+        first. Returns the list of work slots read this way.
+
+        Keyword arguments:
+            - slots: all work slots held in memory
+            - tasks: a mapping of known task IDs to the corresponding task
+                     objects
+
+        """
+        by_partition = {}
+        dirty = set()
+        seen_ids = set()
+        for slot in slots:
+            partition = self.partition_of(slot)
+            by_partition.setdefault(partition, []).append(slot)
+            seen_ids.add(slot.id)
+            old = self._slot_rows.get(slot.id)
+            if old != (partition, self._slot_row(slot)):
+                dirty.add(partition)
+                if old is not None:
+                    dirty.add(old[0])
+        # Partitions of removed slots have changed too.
+        dirty.update(partition for slot_id, (partition, _)
+                     in self._slot_rows.items() if slot_id not in seen_ids)
+
+        added = []
+        for partition in dirty:
+            if partition in self.manifest and partition not in self._loaded:
+                part_slots = self._read_partition(partition, tasks)
+                added.extend(part_slots)
+                # Slots moved to another partition meanwhile are not kept
+                # here.
+                by_partition.setdefault(partition, []).extend(
+                    slot for slot in part_slots if slot.id not in seen_ids)
+        if not dirty:
+            return added
+
+        os.makedirs(self.dirname, exist_ok=True)
+        for partition in dirty:
+            part_slots = by_partition.get(partition, [])
+            part_fname = self._partition_fname(partition)
+            if not part_slots:
+                if os.path.exists(part_fname):
+                    os.remove(part_fname)
+                self.manifest.pop(partition, None)
+                continue
+            with open_backed_up(part_fname, 'wb',
+                                suffix=self.backup_suffix) as outfile:
+                XmlBackend.write_workslots(part_slots, outfile)
+            rows = [self._slot_row(slot) for slot in part_slots]
+            starts = [row[1] for row in rows]
+            ends = [row[3] for row in rows]
+            self.manifest[partition] = {
+                'start': None if None in starts else min(starts),
+                'end': None if None in ends else max(ends),
+                'count': len(part_slots),
+                'max_id': max(slot.id for slot in part_slots)}
+            self._loaded.add(partition)
+        self._slot_rows = dict(
+            (slot.id, (partition, self._slot_row(slot)))
+            for partition, part_slots in by_partition.items()
+            for slot in part_slots)
+
+        manifest_fname = os.path.join(self.dirname, self.MANIFEST_FNAME)
+        with open_atomic(manifest_fname, 'w',
+                         encoding='UTF-8') as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=1, sort_keys=True)
+        return added
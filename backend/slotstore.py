@@ -0,0 +1,427 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+# This code is PEP8-compliant. See http://www.python.org/dev/peps/pep-0008/.
+"""
+
+Wyrd In: Time tracker and task manager
+CC-Share Alike 2012 © The Wyrd In team
+https://github.com/WyrdIn
+
+This module implements a store of work slots kept column by column in
+a memory-mapped file. Opening the store only maps the file, nothing is parsed;
+work slots are accessed through light views of rows of the store, and
+changes made through the views go right to the mapped file.
+
+The file consists of a header of HEADER_SIZE bytes (magic bytes, format
+version, counts of rows, and a table of timezone names), followed by columns
+of `capacity' items each: slot IDs (int64), start and end times as UTC epoch
+seconds (int64), task IDs (int32) and indices into the table of timezones
+(uint16) -- 30 bytes per slot.
+
+"""
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+import json
+import mmap
+import os
+import struct
+
+from backend.generic import time_to_epoch
+from util import open_atomic
+from worktime import WorkSlot
+
+
+class SlotView(WorkSlot):
+    """A work slot backed by a row of a SlotStore.
+
+    Views are created when the store is accessed; two views of the same row
+    compare equal.
+
+    """
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store, row):
+        # Creating a view does not modify anything, so DBObject.__setattr__
+        # is bypassed.
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, '_row', row)
+
+    def __eq__(self, other):
+        return (isinstance(other, SlotView)
+                and self._store is other._store and self._row == other._row)
+
+    def __hash__(self):
+        return hash((id(self._store), self._row))
+
+    @property
+    def _id(self):
+        return self._store._cols['id'][self._row]
+
+    @property
+    def task(self):
+        return self._store.tasks[self._store._cols['task'][self._row]]
+
+    @task.setter
+    def task(self, task):
+        self._store._set_task(self._row, task)
+
+    @property
+    def start_us(self):
+        return self._store._time_us(self._row, 'start')
+
+    @property
+    def end_us(self):
+        return self._store._time_us(self._row, 'end')
+
+    @property
+    def start(self):
+        return self._store._time(self._row, 'start')
+
+    @start.setter
+    def start(self, start):
+        self._store._set_times(self._row, start, self.end)
+
+    @property
+    def end(self):
+        return self._store._time(self._row, 'end')
+
+    @end.setter
+    def end(self, end):
+        self._store._set_times(self._row, self.start, end)
+
+
+class SlotStore(object):
+    """A sequence of work slots stored in a memory-mapped file.
+
+    The store supports iteration, `len', indexing, `append', `extend' and
+    `remove', so that it can stand in for the list of work slots in the
+    session. Removed rows are only marked as such and skipped, so that views
+    keep referring to the right rows.
+
+    Queries for slots of a task, open slots and slots within an interval
+    (`task_slots', `open_slots' and `intersecting') are answered by scanning
+    the columns, creating views only of the rows found.
+
+    """
+    MAGIC = b'WYRDSLOT'
+    VERSION = 1
+    HEADER_SIZE = 4096
+    MIN_CAPACITY = 1024
+
+    # magic, version, rows, live rows, capacity, maximum slot ID
+    _header = struct.Struct('<8sHqqqq')
+    _tzs_len = struct.Struct('<I')
+    _columns = (('id', 'q'),
+                ('start', 'q'),
+                ('end', 'q'),
+                ('task', 'i'),
+                ('tz', 'H'))
+    ROW_SIZE = sum(struct.calcsize(code) for _, code in _columns)
+
+    _none = -2 ** 63  # stands for None in time columns
+    _no_tz = 2 ** 16 - 1  # stands for no timezone (UTC)
+    _removed = -1  # the task ID of removed rows
+
+    def __init__(self, fname, tasks):
+        """Opens the store in the file `fname', creating an empty one if the
+        file does not exist.
+
+        Keyword arguments:
+            - fname: path towards the file
+            - tasks: a mapping of known task IDs to the corresponding task
+                     objects; tasks of slots appended are added to it
+
+        """
+        self.fname = fname
+        self.tasks = tasks
+        # A function of no arguments to call after each modification.
+        self.on_change = None
+        if not os.path.exists(fname):
+            self.write(fname, [])
+        self._file = open(fname, 'r+b')
+        self._mmap = None
+        self._cols = {}
+        # Slot ID -> row, and the array of live rows in order; both are
+        # built when first needed (see `_index_rows').
+        self._rows_by_id = None
+        self._live_rows = None
+        self._map()
+
+    @classmethod
+    def _layout(cls, capacity):
+        """Yields (name, typecode, offset, size) for each column."""
+        offset = cls.HEADER_SIZE
+        for name, code in cls._columns:
+            size = capacity * struct.calcsize(code)
+            yield name, code, offset, size
+            offset += size
+
+    @classmethod
+    def _pack_header(cls, nrows, nlive, capacity, max_id, zones):
+        header = cls._header.pack(cls.MAGIC, cls.VERSION, nrows, nlive,
+                                  capacity, max_id)
+        tzs = json.dumps(zones).encode('UTF-8')
+        header += cls._tzs_len.pack(len(tzs)) + tzs
+        if len(header) > cls.HEADER_SIZE:
+            raise ValueError('Too many timezones for the slot store header.')
+        return header.ljust(cls.HEADER_SIZE, b'\0')
+
+    def _map(self):
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        (magic, version, self._nrows, self._nlive, self._capacity,
+         self.max_id) = self._header.unpack_from(self._mmap)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError('{fname} is not a slot store of a supported '
+                             'version.'.format(fname=self.fname))
+        tzs_len, = self._tzs_len.unpack_from(self._mmap, self._header.size)
+        tzs_start = self._header.size + self._tzs_len.size
+        self._zones = json.loads(
+            self._mmap[tzs_start:tzs_start + tzs_len].decode('UTF-8'))
+        self._zone_idxs = dict((zone, idx)
+                               for idx, zone in enumerate(self._zones))
+        self._tzinfos = {}  # index into _zones -> tzinfo
+        mview = memoryview(self._mmap)
+        for name, code, offset, size in self._layout(self._capacity):
+            self._cols[name] = mview[offset:offset + size].cast(code)
+        mview.release()
+
+    def _unmap(self):
+        for col in self._cols.values():
+            col.release()
+        self._cols = {}
+        self._mmap.close()
+
+    def _write_header(self):
+        self._mmap[:self.HEADER_SIZE] = self._pack_header(
+            self._nrows, self._nlive, self._capacity, self.max_id,
+            self._zones)
+
+    def _grow(self):
+        """Doubles the capacity of the store."""
+        data = dict((name, col[:self._nrows].tobytes())
+                    for name, col in self._cols.items())
+        self._unmap()
+        self._capacity *= 2
+        self._file.truncate(self.HEADER_SIZE + self._capacity * self.ROW_SIZE)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._write_header()
+        self._mmap.close()
+        self._map()
+        for name, col in self._cols.items():
+            col[:self._nrows] = memoryview(data[name]).cast(col.format)
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def _zone_idx(self, zone):
+        if zone is None:
+            return self._no_tz
+        try:
+            return self._zone_idxs[zone]
+        except KeyError:
+            self._zones.append(zone)
+            self._zone_idxs[zone] = len(self._zones) - 1
+            self._write_header()
+            return self._zone_idxs[zone]
+
+    def _time_us(self, row, col_name):
+        epoch = self._cols[col_name][row]
+        return None if epoch == self._none else epoch * 1000000
+
+    def _time(self, row, col_name):
+        epoch = self._cols[col_name][row]
+        if epoch == self._none:
+            return None
+        zone_idx = self._cols['tz'][row]
+        try:
+            tzinfo = self._tzinfos[zone_idx]
+        except KeyError:
+            import pytz
+            tzinfo = self._tzinfos[zone_idx] = pytz.timezone(
+                'UTC' if zone_idx == self._no_tz else self._zones[zone_idx])
+        return datetime.fromtimestamp(epoch, tzinfo)
+
+    def _set_times(self, row, start, end):
+        # One timezone is kept per slot, that of the start (if any).
+        start_epoch, start_zone = time_to_epoch(start)
+        end_epoch, end_zone = time_to_epoch(end)
+        self._cols['start'][row] = (self._none if start_epoch is None
+                                    else start_epoch)
+        self._cols['end'][row] = self._none if end_epoch is None else end_epoch
+        self._cols['tz'][row] = self._zone_idx(
+            start_zone if start is not None else end_zone)
+        self._changed()
+
+    def _set_task(self, row, task):
+        self.tasks[task.id] = task
+        self._cols['task'][row] = task.id
+        self._changed()
+
+    def _index_rows(self):
+        """Builds the index of live rows by slot ID and the array of live
+        rows, unless they have been built already.
+
+        """
+        if self._rows_by_id is None:
+            ids = self._cols['id'][:self._nrows]
+            tasks = self._cols['task'][:self._nrows]
+            self._live_rows = array('q', (row for row, task_id
+                                          in enumerate(tasks)
+                                          if task_id != self._removed))
+            self._rows_by_id = dict((ids[row], row)
+                                    for row in self._live_rows)
+
+    def _row_of(self, slot):
+        if isinstance(slot, SlotView) and slot._store is self:
+            return slot._row
+        self._index_rows()
+        return self._rows_by_id.get(slot.id)
+
+    def _views(self, rows):
+        return [SlotView(self, row) for row in rows]
+
+    def task_slots(self, task):
+        """Returns views of the work slots of the task `task'."""
+        tasks = self._cols['task'][:self._nrows]
+        return self._views(row for row, task_id in enumerate(tasks)
+                           if task_id == task.id)
+
+    def open_slots(self):
+        """Returns views of the work slots that have not ended yet."""
+        ends = self._cols['end'][:self._nrows]
+        tasks = self._cols['task'][:self._nrows]
+        return self._views(row for row, end in enumerate(ends)
+                           if end == self._none
+                           and tasks[row] != self._removed)
+
+    def intersecting(self, invl):
+        """Returns views of the work slots that intersect the Interval
+        `invl' (as tested by Interval.intersects).
+
+        """
+        # Times are kept in seconds: a slot starts after the end of `invl'
+        # iff its start is greater than `last', and ends before the start of
+        # `invl' iff its end is less than `first'. The value standing for
+        # None is less than any time, and so passes the former test.
+        last = None if invl.end_us is None else invl.end_us // 1000000
+        first = (None if invl.start_us is None
+                 else -(-invl.start_us // 1000000))
+        nrows = self._nrows
+        rows = zip(range(nrows),
+                   self._cols['start'][:nrows],
+                   self._cols['end'][:nrows],
+                   self._cols['task'][:nrows])
+        return self._views(row for row, start, end, task_id in rows
+                           if task_id != self._removed
+                           and (last is None or start <= last)
+                           and (first is None or end == self._none
+                                or end >= first))
+
+    def __len__(self):
+        return self._nlive
+
+    def __iter__(self):
+        tasks = self._cols['task']
+        for row in range(self._nrows):
+            if tasks[row] != self._removed:
+                yield SlotView(self, row)
+
+    def __getitem__(self, idx):
+        if self._nlive == self._nrows and isinstance(idx, int):
+            if idx < 0:
+                idx += self._nrows
+            if not 0 <= idx < self._nrows:
+                raise IndexError('SlotStore index out of range')
+            return SlotView(self, idx)
+        self._index_rows()
+        if isinstance(idx, slice):
+            return self._views(self._live_rows[idx])
+        try:
+            return SlotView(self, self._live_rows[idx])
+        except IndexError:
+            raise IndexError('SlotStore index out of range')
+
+    def append(self, slot):
+        """Appends a copy of the work slot `slot' to the store."""
+        if self._nrows == self._capacity:
+            self._grow()
+        row = self._nrows
+        self._cols['id'][row] = slot.id
+        if self._rows_by_id is not None:
+            self._rows_by_id[slot.id] = row
+            self._live_rows.append(row)
+        self._nrows += 1
+        self._nlive += 1
+        self.max_id = max(self.max_id, slot.id)
+        self._set_task(row, slot.task)
+        self._set_times(row, slot.start, slot.end)
+        self._write_header()
+
+    def extend(self, slots):
+        for slot in slots:
+            self.append(slot)
+
+    def remove(self, slot):
+        """Removes the work slot `slot' (a view or a slot with the same ID)
+        from the store.
+
+        """
+        row = self._row_of(slot)
+        if row is None or self._cols['task'][row] == self._removed:
+            raise ValueError('SlotStore.remove(x): x not in the store')
+        self._cols['task'][row] = self._removed
+        if self._rows_by_id is not None:
+            del self._rows_by_id[self._cols['id'][row]]
+            del self._live_rows[bisect_left(self._live_rows, row)]
+        self._nlive -= 1
+        self._write_header()
+        self._changed()
+
+    def flush(self):
+        """Makes sure all changes have reached the file."""
+        self._mmap.flush()
+
+    def close(self):
+        self.flush()
+        self._unmap()
+        self._file.close()
+
+    @classmethod
+    def write(cls, fname, slots):
+        """Writes out a new store with the work slots `slots' to the file
+        `fname', replacing the file atomically.
+
+        """
+        cols = dict((name, array(code)) for name, code in cls._columns)
+        zones = []
+        zone_idxs = {}
+        max_id = -1
+        for slot in slots:
+            start_epoch, start_zone = time_to_epoch(slot.start)
+            end_epoch, end_zone = time_to_epoch(slot.end)
+            zone = start_zone if slot.start is not None else end_zone
+            if zone is None:
+                zone_idx = cls._no_tz
+            else:
+                zone_idx = zone_idxs.get(zone)
+                if zone_idx is None:
+                    zone_idx = zone_idxs[zone] = len(zones)
+                    zones.append(zone)
+            cols['id'].append(slot.id)
+            cols['start'].append(cls._none if start_epoch is None
+                                 else start_epoch)
+            cols['end'].append(cls._none if end_epoch is None else end_epoch)
+            cols['task'].append(slot.task.id)
+            cols['tz'].append(zone_idx)
+            max_id = max(max_id, slot.id)
+        nrows = len(cols['id'])
+        capacity = max(cls.MIN_CAPACITY, nrows)
+        with open_atomic(fname, 'wb') as outfile:
+            outfile.write(cls._pack_header(nrows, nrows, capacity, max_id,
+                                           zones))
+            for name, code, _, size in cls._layout(capacity):
+                data = cols[name].tobytes()
+                outfile.write(data)
+                outfile.write(bytes(size - len(data)))
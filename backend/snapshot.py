@@ -0,0 +1,360 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+# This code is PEP8-compliant. See http://www.python.org/dev/peps/pep-0008/.
+"""
+
+Wyrd In: Time tracker and task manager
+CC-Share Alike 2012 © The Wyrd In team
+https://github.com/WyrdIn
+
+This module implements a compact binary snapshot of user's data, kept next to
+the XML file as a cache that loads much faster than the XML itself.
+
+The snapshot consists of:
+    - a header: magic bytes, format version, and the size and modification
+      time of the XML file the snapshot mirrors;
+    - a table of strings (task names, projects and timezone names), each
+      stored only once and referred to by its index;
+    - fixed-size records of tasks, variable-size records of groupings, and
+      fixed-size records of work slots, with times stored as UTC epoch
+      seconds;
+    - fixed-size records of links of tasks to their prerequisites and to
+      soes they enable, stored as strings of short_reprs.
+
+"""
+from datetime import datetime, timedelta
+import os
+import struct
+
+from backend.generic import (resolve_task_links, task_link_refs,
+                             time_to_epoch)
+from grouping import SoeGrouping, AndGroup, OrGroup, ListGroup
+from task import Task
+
+
+class SnapshotBackend(object):
+    """Reads and writes user's data from/to a binary snapshot."""
+    MAGIC = b'WYRDSNAP'
+    VERSION = 2
+
+    _header = struct.Struct('<8sHqq')  # magic, version, source stat
+    _count = struct.Struct('<I')
+    # id, name, project, flags, time, deadline, deadline timezone
+    _task = struct.Struct('<qIIBdqI')
+    # id, type, top, number of members
+    _group = struct.Struct('<qBBI')
+    # type, id
+    _member = struct.Struct('<Bq')
+    # id, task, start, start timezone, end, end timezone
+    _slot = struct.Struct('<qqqIqI')
+    # task, prerequisites, enables
+    _link = struct.Struct('<qII')
+
+    _none = -2 ** 63  # stands for None in integer fields
+    _no_str = 2 ** 32 - 1  # stands for None in string fields
+
+    _DONE = 1
+    _HAS_TIME = 2
+
+    # Codes of types of group members.
+    _TASK = 0
+    _code2cls = {1: AndGroup, 2: OrGroup, 3: ListGroup}
+    _cls2code = dict((cls, code) for code, cls in _code2cls.items())
+
+    @staticmethod
+    def source_stat(fname):
+        """Returns the (size, modification time) of the file `fname', as
+        recorded in snapshots of it.
+
+        """
+        stat = os.stat(fname)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def is_fresh(cls, fname, source_fname):
+        """Tells whether the snapshot in the file `fname' exists and mirrors
+        the current contents of the file `source_fname'.
+
+        """
+        try:
+            with open(fname, 'rb') as infile:
+                header = infile.read(cls._header.size)
+            source_stat = cls.source_stat(source_fname)
+        except OSError:
+            return False
+        if len(header) < cls._header.size:
+            return False
+        magic, version, size, mtime = cls._header.unpack(header)
+        return (magic == cls.MAGIC and version == cls.VERSION
+                and (size, mtime) == source_stat)
+
+    @classmethod
+    def _group_code(cls, group):
+        return cls._cls2code[type(group)]
+
+    @classmethod
+    def write(cls, tasks, groups, slots, outfile, source_stat=(0, 0),
+              extra_slots=()):
+        """Writes out tasks, groupings and work slots as a snapshot to the
+        file `outfile'.
+
+        Keyword arguments:
+            - tasks: an iterable of objects of the type Task
+            - groups: an iterable of top-level objects of the type SoeGrouping
+            - slots: an iterable of objects of the type WorkSlot
+            - outfile: a file open for binary writing
+            - source_stat: the (size, modification time) of the file the
+                           snapshot mirrors, as returned by `source_stat'
+            - extra_slots: records of further work slots, which have not
+                           been loaded, as returned by `read_slot_records'
+
+        """
+        strings = {}  # string -> index into the string table
+
+        def intern(string):
+            if string is None:
+                return cls._no_str
+            return strings.setdefault(string, len(strings))
+
+        def pack_time(dt):
+            epoch, zone = time_to_epoch(dt)
+            if epoch is None:
+                return cls._none, cls._no_str
+            return epoch, intern(zone)
+
+        chunks = []
+        chunks.append(cls._count.pack(len(tasks)))
+        for task in tasks:
+            flags = cls._DONE if task.done else 0
+            time = 0.
+            if hasattr(task, 'time'):
+                flags |= cls._HAS_TIME
+                time = task.time.total_seconds()
+            chunks.append(cls._task.pack(
+                task.id, intern(task.name), intern(task.project), flags,
+                time, *pack_time(getattr(task, 'deadline', None))))
+
+        # Record all groups reachable from the top-level ones.
+        top_groups = set(groups)
+        group_recs = []
+        to_visit = list(groups)
+        seen = set()
+        while to_visit:
+            group = to_visit.pop()
+            if group in seen:
+                continue
+            seen.add(group)
+            group_recs.append(group)
+            to_visit.extend(member for member in group.elems
+                            if isinstance(member, SoeGrouping))
+        chunks.append(cls._count.pack(len(group_recs)))
+        for group in group_recs:
+            chunks.append(cls._group.pack(
+                group.id, cls._group_code(group), group in top_groups,
+                len(group.elems)))
+            for member in group.elems:
+                if isinstance(member, SoeGrouping):
+                    chunks.append(cls._member.pack(cls._group_code(member),
+                                                   member.id))
+                else:
+                    chunks.append(cls._member.pack(cls._TASK, member.id))
+
+        chunks.append(cls._count.pack(len(slots) + len(extra_slots)))
+        for slot in slots:
+            chunks.append(cls._slot.pack(slot.id, slot.task.id,
+                                         *(pack_time(slot.start)
+                                           + pack_time(slot.end))))
+        for slot_id, task_id, start, start_tz, end, end_tz in extra_slots:
+            chunks.append(cls._slot.pack(
+                slot_id, task_id,
+                cls._none if start is None else start, intern(start_tz),
+                cls._none if end is None else end, intern(end_tz)))
+
+        links = []
+        for task in tasks:
+            prereqs, enables = task_link_refs(task)
+            if prereqs is not None or enables:
+                links.append(cls._link.pack(task.id, intern(prereqs),
+                                            intern(', '.join(enables))))
+        chunks.append(cls._count.pack(len(links)))
+        chunks.extend(links)
+
+        outfile.write(cls._header.pack(cls.MAGIC, cls.VERSION, *source_stat))
+        outfile.write(cls._count.pack(len(strings)))
+        for string in strings:
+            data = string.encode('UTF-8')
+            outfile.write(cls._count.pack(len(data)))
+            outfile.write(data)
+        outfile.write(b''.join(chunks))
+
+    @classmethod
+    def read_slot_records(cls, infile):
+        """Reads the records of work slots from a snapshot in the file
+        `infile' open for binary reading, without creating any objects.
+
+        Returns a list of tuples (slot ID, task ID, start, name of the start
+        timezone, end, name of the end timezone), with times as UTC epoch
+        seconds, or None.
+
+        """
+        data = infile.read()
+        magic, version, _, _ = cls._header.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError('Not a snapshot of a supported version.')
+        pos = cls._header.size
+        strings = []
+        nstrings, = cls._count.unpack_from(data, pos)
+        pos += cls._count.size
+        for _ in range(nstrings):
+            length, = cls._count.unpack_from(data, pos)
+            pos += cls._count.size
+            strings.append(data[pos:pos + length].decode('UTF-8'))
+            pos += length
+        # Skip the tasks and the groupings.
+        ntasks, = cls._count.unpack_from(data, pos)
+        pos += cls._count.size + cls._task.size * ntasks
+        ngroups, = cls._count.unpack_from(data, pos)
+        pos += cls._count.size
+        for _ in range(ngroups):
+            nmembers = cls._group.unpack_from(data, pos)[3]
+            pos += cls._group.size + cls._member.size * nmembers
+        nslots, = cls._count.unpack_from(data, pos)
+        pos += cls._count.size
+        none, no_str = cls._none, cls._no_str
+        return [(slot_id, task_id,
+                 None if start == none else start,
+                 None if start_tz == no_str else strings[start_tz],
+                 None if end == none else end,
+                 None if end_tz == no_str else strings[end_tz])
+                for slot_id, task_id, start, start_tz, end, end_tz
+                in cls._slot.iter_unpack(
+                    data[pos:pos + cls._slot.size * nslots])]
+
+    @classmethod
+    def read(cls, infile, read_slots=True):
+        """Reads a snapshot from the file `infile' open for binary reading.
+
+        Returns a tuple (tasks, groups, slots).
+
+        Keyword arguments:
+            - infile: a file open for binary reading
+            - read_slots: if False, records of work slots are skipped, and
+                          the list of slots returned is empty
+
+        """
+        from worktime import WorkSlot
+        import pytz
+        data = infile.read()
+        magic, version, _, _ = cls._header.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError('Not a snapshot of a supported version.')
+        pos = cls._header.size
+
+        def read_block(rec, count):
+            nonlocal pos
+            end = pos + rec.size * count
+            recs = rec.iter_unpack(data[pos:end])
+            pos = end
+            return recs
+
+        def read_count():
+            nonlocal pos
+            count, = cls._count.unpack_from(data, pos)
+            pos += cls._count.size
+            return count
+
+        strings = []
+        for _ in range(read_count()):
+            length = read_count()
+            strings.append(data[pos:pos + length].decode('UTF-8'))
+            pos += length
+        zones = {}  # string index -> timezone
+
+        def unpack_zone(zone_idx):
+            try:
+                return zones[zone_idx]
+            except KeyError:
+                zone = zones[zone_idx] = pytz.timezone(
+                    string(zone_idx) or 'UTC')
+                return zone
+
+        def unpack_time(epoch, zone_idx):
+            if epoch == cls._none:
+                return None
+            return datetime.fromtimestamp(epoch, unpack_zone(zone_idx))
+
+        # Times of slots are unpacked the way worktime.Interval keeps them.
+        def unpack_time_us(epoch, zone_idx):
+            if epoch == cls._none:
+                return None, None
+            return epoch * 1000000, unpack_zone(zone_idx)
+
+        def string(idx):
+            return None if idx == cls._no_str else strings[idx]
+
+        tasks = []
+        tasks_map = {}  # task ID -> task
+        for (task_id, name, project, flags, time, deadline,
+             deadline_tz) in read_block(cls._task, read_count()):
+            task = Task(name=string(name), project=string(project),
+                        id=task_id)
+            task.done = bool(flags & cls._DONE)
+            if flags & cls._HAS_TIME:
+                task.time = timedelta(seconds=time)
+            if deadline != cls._none:
+                task.deadline = unpack_time(deadline, deadline_tz)
+            tasks.append(task)
+            tasks_map[task_id] = task
+
+        groups = []
+        groups_map = {}  # (type code, ID) -> group
+        group_members = []
+        for _ in range(read_count()):
+            group_id, code, top, nmembers = cls._group.unpack_from(data, pos)
+            pos += cls._group.size
+            group = cls._code2cls[code](id=group_id)
+            groups_map[(code, group_id)] = group
+            group_members.append((group, list(read_block(cls._member,
+                                                         nmembers))))
+            if top:
+                groups.append(group)
+        # Groups may refer to groups recorded later, so members are resolved
+        # only after all groups have been created. Members not known (tasks
+        # removed since, for one) are dropped.
+        for group, members in group_members:
+            elems = []
+            for code, member_id in members:
+                if code == cls._TASK:
+                    member = tasks_map.get(member_id)
+                else:
+                    member = groups_map.get((code, member_id))
+                if member is not None:
+                    elems.append(member)
+            group.elems = elems
+
+        slots = []
+        nslots = read_count()
+        if not read_slots:
+            pos += cls._slot.size * nslots
+            nslots = 0
+        for (slot_id, task_id, start, start_tz, end,
+             end_tz) in read_block(cls._slot, nslots):
+            if task_id not in tasks_map:
+                continue
+            slots.append(WorkSlot.from_us(tasks_map[task_id],
+                                          *(unpack_time_us(start, start_tz)
+                                            + unpack_time_us(end, end_tz)),
+                                          id=slot_id))
+
+        links = {}  # task -> references to its prerequisites and enables
+        for task_id, prereqs, enables in read_block(cls._link, read_count()):
+            enables = string(enables)
+            if task_id not in tasks_map:
+                continue
+            links[tasks_map[task_id]] = (
+                string(prereqs),
+                [ref.strip() for ref in enables.split(',')] if enables else [])
+        resolve_task_links(links, tasks_map,
+                           dict((group.short_repr(), group)
+                                for group in groups_map.values()))
+        return tasks, groups, slots
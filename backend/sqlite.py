@@ -0,0 +1,305 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+# This code is PEP8-compliant. See http://www.python.org/dev/peps/pep-0008/.
+"""
+
+Wyrd In: Time tracker and task manager
+CC-Share Alike 2012 © The Wyrd In team
+https://github.com/WyrdIn
+
+This module implements storing user's data in an SQLite database. Tasks,
+groupings and work slots are kept in tables indexed on the columns they are
+looked up by, so that e.g. work slots from a given time interval can be
+selected without reading the whole log.
+
+"""
+from datetime import timedelta
+import sqlite3
+
+from backend.generic import (resolve_task_links, task_link_refs,
+                             time_from_epoch, time_to_epoch,
+                             time_us_from_epoch)
+from grouping import SoeGrouping, AndGroup, OrGroup, ListGroup
+from task import Task
+
+
+class SqliteBackend(object):
+    """Reads and writes user's data from/to an SQLite database.
+
+    The backend remembers the rows it has read or written, so that writing
+    touches only rows of objects that changed in the meantime.
+
+    """
+    _schema = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            project TEXT,
+            done INTEGER NOT NULL DEFAULT 0,
+            time REAL,
+            deadline INTEGER,
+            deadline_tz TEXT);
+        CREATE INDEX IF NOT EXISTS tasks_project ON tasks (project);
+        CREATE TABLE IF NOT EXISTS task_links (
+            id INTEGER PRIMARY KEY,
+            prerequisites TEXT,
+            enables TEXT);
+        CREATE TABLE IF NOT EXISTS groups (
+            id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            top INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS group_members (
+            grp TEXT NOT NULL,
+            pos INTEGER NOT NULL,
+            member TEXT NOT NULL,
+            PRIMARY KEY (grp, pos));
+        CREATE TABLE IF NOT EXISTS workslots (
+            id INTEGER PRIMARY KEY,
+            task INTEGER NOT NULL,
+            start INTEGER,
+            start_tz TEXT,
+            end INTEGER,
+            end_tz TEXT);
+        CREATE INDEX IF NOT EXISTS workslots_task ON workslots (task);
+        CREATE INDEX IF NOT EXISTS workslots_start ON workslots (start);
+        CREATE INDEX IF NOT EXISTS workslots_end ON workslots (end);
+        """
+
+    _typestr2cls = {'and': AndGroup,
+                    'or': OrGroup,
+                    'list': ListGroup}
+
+    def __init__(self, fname):
+        """Opens (or creates) the database in the file `fname'."""
+        self.fname = fname
+        self.conn = sqlite3.connect(fname)
+        self.conn.executescript(self._schema)
+        # Rows as last read from or written to the database.
+        self._task_rows = {}  # task ID -> row
+        self._group_rows = {}  # group short_repr -> (row, members)
+        self._slot_rows = {}  # slot ID -> row
+        self._link_rows = {}  # task ID -> row of task_links
+        # Whether all work slots from the database have been read.
+        self.log_complete = False
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def _task_row(task):
+        deadline, deadline_tz = time_to_epoch(getattr(task, 'deadline', None))
+        time = task.time.total_seconds() if hasattr(task, 'time') else None
+        return (task.id, task.name, task.project, int(task.done), time,
+                deadline, deadline_tz)
+
+    @staticmethod
+    def _link_row(task):
+        """Returns the row of task_links for the task, or None if the task
+        has no links.
+
+        """
+        prereqs, enables = task_link_refs(task)
+        if prereqs is None and not enables:
+            return None
+        return (task.id, prereqs, ', '.join(enables))
+
+    @staticmethod
+    def _slot_row(slot):
+        return ((slot.id, slot.task.id)
+                + time_to_epoch(slot.start)
+                + time_to_epoch(slot.end))
+
+    def read_tasks(self):
+        """Reads all tasks from the database."""
+        tasks = []
+        for row in self.conn.execute('SELECT * FROM tasks ORDER BY id'):
+            id_, name, project, done, time, deadline, deadline_tz = row
+            task = Task(name=name, project=project, id=id_)
+            task.done = bool(done)
+            if time is not None:
+                task.time = timedelta(seconds=time)
+            if deadline is not None:
+                task.deadline = time_from_epoch(deadline, deadline_tz)
+            tasks.append(task)
+            self._task_rows[id_] = row
+        return tasks
+
+    def read_groups(self, tasks):
+        """Reads all top-level groupings from the database.
+
+        Keyword arguments:
+            - tasks: a mapping of known task IDs to the corresponding task
+                     objects
+
+        """
+        groups = []
+        groups_map = {}  # short_repr -> group
+        for row in self.conn.execute('SELECT * FROM groups'):
+            grp_repr, grp_type, top = row
+            group = self._typestr2cls[grp_type](short_repr=grp_repr)
+            groups_map[grp_repr] = group
+            self._group_rows[grp_repr] = (row, ())
+            if top:
+                groups.append(group)
+        for grp_repr, member in self.conn.execute(
+                'SELECT grp, member FROM group_members ORDER BY grp, pos'):
+            group = groups_map[grp_repr]
+            if member in groups_map:
+                group.elems.append(groups_map[member])
+            elif int(member[1:]) in tasks:
+                group.elems.append(tasks[int(member[1:])])
+            # Members not known (tasks removed since, for one) are dropped,
+            # but remembered as stored, so that the rows get rewritten.
+            row, members = self._group_rows[grp_repr]
+            self._group_rows[grp_repr] = (row, members + (member, ))
+        # Links of tasks can refer to groupings, so they are resolved along
+        # with groupings.
+        links = {}  # task -> references to its prerequisites and enables
+        for row in self.conn.execute('SELECT * FROM task_links'):
+            task_id, prereqs, enables = row
+            if task_id not in tasks:
+                continue
+            links[tasks[task_id]] = (
+                prereqs,
+                [ref.strip() for ref in enables.split(',')] if enables else [])
+            self._link_rows[task_id] = row
+        resolve_task_links(links, tasks, groups_map)
+        return groups
+
+    def read_workslots(self, tasks, invl=None, open_only=False):
+        """Reads work slots from the database.
+
+        Only the slots selected are read, using the indexes in the database.
+        Slots that have been read already are skipped.
+
+        Keyword arguments:
+            - tasks: a mapping of known task IDs to the corresponding task
+                     objects
+            - invl: if specified, only slots intersecting this Interval are
+                    read
+            - open_only: if True, only slots that have not ended yet are read
+
+        """
+        from worktime import WorkSlot
+        conds = []
+        params = []
+        if open_only:
+            conds.append('end IS NULL')
+        if invl is not None:
+            if invl.end is not None:
+                conds.append('(start IS NULL OR start <= ?)')
+                params.append(time_to_epoch(invl.end)[0])
+            if invl.start is not None:
+                conds.append('(end IS NULL OR end >= ?)')
+                params.append(time_to_epoch(invl.start)[0])
+        query = 'SELECT * FROM workslots'
+        if conds:
+            query += ' WHERE ' + ' AND '.join(conds)
+        query += ' ORDER BY id'
+        slots = []
+        for row in self.conn.execute(query, params):
+            id_, task_id, start, start_tz, end, end_tz = row
+            if id_ in self._slot_rows:
+                continue
+            slots.append(WorkSlot.from_us(tasks[task_id],
+                                          *(time_us_from_epoch(start, start_tz)
+                                            + time_us_from_epoch(end, end_tz)),
+                                          id=id_))
+            self._slot_rows[id_] = row
+        if not conds:
+            self.log_complete = True
+        return slots
+
+    def max_slot_id(self):
+        """Returns the maximum ID of any work slot stored (-1 if there are
+        none).
+
+        """
+        max_id = self.conn.execute(
+            'SELECT MAX(id) FROM workslots').fetchone()[0]
+        return -1 if max_id is None else max_id
+
+    def read_all(self):
+        """Reads all tasks, groupings and work slots from the database.
+
+        Returns a tuple (tasks, groups, slots).
+
+        """
+        tasks = self.read_tasks()
+        tasks_map = dict((task.id, task) for task in tasks)
+        return (tasks,
+                self.read_groups(tasks_map),
+                self.read_workslots(tasks_map))
+
+    def _sync(self, table, old_rows, new_rows):
+        """Updates rows of `table' that differ between `old_rows' and
+        `new_rows', both of which map the primary key to the row.
+
+        """
+        changed = [row for key, row in new_rows.items()
+                   if old_rows.get(key) != row]
+        removed = [(key, ) for key in old_rows if key not in new_rows]
+        if changed:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO {tbl} VALUES ({qmarks})'.format(
+                    tbl=table, qmarks=', '.join('?' * len(changed[0]))),
+                changed)
+        if removed:
+            self.conn.executemany(
+                'DELETE FROM {tbl} WHERE id = ?'.format(tbl=table), removed)
+
+    def write_all(self, tasks, groups, slots):
+        """Writes to the database those of the tasks, groupings and work slots
+        that have changed since they were read, and deletes those that have
+        been removed.
+
+        Work slots that have not been read are left untouched.
+
+        """
+        task_rows = dict((task.id, self._task_row(task)) for task in tasks)
+        slot_rows = dict((slot.id, self._slot_row(slot)) for slot in slots)
+        link_rows = dict((row[0], row) for row in map(self._link_row, tasks)
+                         if row is not None)
+        # Collect all groups reachable from the top-level ones.
+        group_rows = {}
+        top_groups = set(groups)
+        to_visit = list(groups)
+        while to_visit:
+            group = to_visit.pop()
+            grp_repr = group.short_repr()
+            if grp_repr in group_rows:
+                continue
+            group_rows[grp_repr] = (
+                (grp_repr, type(group).name, int(group in top_groups)),
+                tuple(member.short_repr() for member in group.elems))
+            to_visit.extend(member for member in group.elems
+                            if isinstance(member, SoeGrouping))
+
+        with self.conn:
+            self._sync('tasks', self._task_rows, task_rows)
+            self._sync('workslots', self._slot_rows, slot_rows)
+            self._sync('task_links', self._link_rows, link_rows)
+            self._sync('groups',
+                       dict((key, row) for key, (row, _)
+                            in self._group_rows.items()),
+                       dict((key, row) for key, (row, _)
+                            in group_rows.items()))
+            for grp_repr, (_, members) in group_rows.items():
+                old = self._group_rows.get(grp_repr)
+                if old is not None and old[1] == members:
+                    continue
+                self.conn.execute('DELETE FROM group_members WHERE grp = ?',
+                                  (grp_repr, ))
+                self.conn.executemany(
+                    'INSERT INTO group_members VALUES (?, ?, ?)',
+                    [(grp_repr, pos, member)
+                     for pos, member in enumerate(members)])
+            for grp_repr in self._group_rows:
+                if grp_repr not in group_rows:
+                    self.conn.execute(
+                        'DELETE FROM group_members WHERE grp = ?',
+                        (grp_repr, ))
+        self._task_rows = task_rows
+        self._slot_rows = slot_rows
+        self._link_rows = link_rows
+        self._group_rows = group_rows
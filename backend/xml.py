@@ -12,14 +12,142 @@ https://github.com/WyrdIn
 
 """
 from lxml import etree
+from array import array
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
+import io
+import itertools
+import json
+import os
+import re
+import sys
+
 import pytz
 
+from backend.generic import (resolve_task_links, task_link_refs,
+                             time_to_epoch)
+from groupgraph import topological_order
 from grouping import SoeGrouping, AndGroup, OrGroup, ListGroup
 from task import Task
+from timezones import localize
+from util import open_atomic
 from wyrdin import session
 
 
+class TimeCodec(object):
+    """Converts datetimes to and from attributes of XML elements. A datetime
+    is recorded as its local time, formatted by TIME_FORMAT_REPR, and the
+    name of its timezone in an attribute of its own, which is left out for
+    the default timezone.
+
+    Times in the default representation, `%Y-%m-%d %H:%M:%S', are
+    converted without strptime and strftime, which dominate reading and
+    writing of large files otherwise. Timezone objects are cached by name,
+    so one codec should be used for all times of a document.
+
+    """
+    FAST_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, default_tz=None, time_format=None):
+        """Creates a codec.
+
+        Keyword arguments:
+            - default_tz: the default timezone object of the document; times
+                          in other timezones have their timezone recorded
+                          (optional)
+            - time_format: the format of times (default: TIME_FORMAT_REPR
+                           from the configuration)
+
+        """
+        self.default_tz = default_tz
+        if time_format is None:
+            time_format = session.config['TIME_FORMAT_REPR']
+        self.time_format = time_format
+        self._fast = time_format == self.FAST_FORMAT
+        self._zones = {}  # name -> timezone object
+
+    def zone(self, name):
+        """Returns the timezone object for the timezone name `name'."""
+        try:
+            return self._zones[name]
+        except KeyError:
+            zone = self._zones[name] = pytz.timezone(name)
+            return zone
+
+    def decode(self, value, zone_name=None):
+        """Returns the datetime represented by the string `value' in the
+        timezone named `zone_name' (by default, the default timezone, or
+        UTC if there is none).
+
+        """
+        if zone_name is None:
+            tzinfo = self.default_tz or pytz.utc
+        else:
+            tzinfo = self.zone(zone_name)
+        # fromisoformat accepts more than the format, so only strings of the
+        # exact length are trusted to it.
+        if self._fast and len(value) == 19:
+            return localize(datetime.fromisoformat(value), tzinfo)
+        return localize(datetime.strptime(value, self.time_format), tzinfo)
+
+    def decode_many(self, values, zone_names=None):
+        """Returns the list of datetimes represented by strings in
+        `values'.
+
+        Keyword arguments:
+            - values: an iterable of strings representing the times
+            - zone_names: an iterable of names of timezones of the times,
+                          parallel to `values', with None for the default
+                          timezone (default: all times are in the default
+                          timezone)
+
+        """
+        if zone_names is None:
+            zone_names = itertools.repeat(None)
+        return list(map(self.decode, values, zone_names))
+
+    def encode(self, dt):
+        """Returns the pair (string representing `dt', name of its timezone),
+        the name being None for the default timezone and naive datetimes.
+
+        """
+        if self._fast:
+            value = '%04d-%02d-%02d %02d:%02d:%02d' % (
+                dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+        else:
+            value = datetime.strftime(dt, self.time_format)
+        tzinfo = dt.tzinfo
+        if tzinfo is None or tzinfo is self.default_tz:
+            return value, None
+        # pytz zones are named by `zone'; their tznames, such as `CEST', are
+        # ambiguous and could not be read back.
+        zone_name = getattr(tzinfo, 'zone', None)
+        if zone_name is None:
+            zone_name = dt.tzname()
+        elif zone_name == getattr(self.default_tz, 'zone', None):
+            return value, None
+        return value, zone_name
+
+    def read(self, attrs, attr):
+        """Returns the time recorded in the attribute `attr' (and its
+        timezone in `attr'_tz) of `attrs', attributes of an XML element.
+        Assumes `attrs' specify `attr'.
+
+        """
+        return self.decode(attrs[attr], attrs.get(attr + '_tz'))
+
+    def write(self, elem, dt, name):
+        """Records the datetime `dt' in attributes of the XML element `elem',
+        as the attribute `name' (and `name'_tz). Does nothing for None.
+
+        """
+        if dt is not None:
+            value, zone_name = self.encode(dt)
+            elem.set(name, value)
+            if zone_name is not None:
+                elem.set(name + '_tz', zone_name)
+
+
 # TODO: Inherit from IBackend (to be implemented).
 class XmlBackend(object):
     parser = etree.XMLParser(remove_blank_text=True)
@@ -35,7 +163,7 @@ class XmlBackend(object):
         return timedelta(days=int(parts[0]), seconds=int(parts[2]))
 
     @classmethod
-    def _read_time(cls, attrs, attr, default_tz=None):
+    def _read_time(cls, attrs, attr, default_tz=None, codec=None):
         """Reads time data from XML element's attributes.
 
         Assumes `attrs' specify `attr'.
@@ -45,18 +173,16 @@ class XmlBackend(object):
             attr -- name of the attribute in question
             default_tz -- the default timezone object to use when none was
                           specified (optional)
+            codec -- the TimeCodec of the document being read; if given,
+                     `default_tz' is ignored in favour of the codec's
 
         """
-        dt = datetime.strptime(attrs[attr], session.config['TIME_FORMAT_REPR'])
-        tz_attr = '{}_tz'.format(attr)
-        if tz_attr in attrs:
-            dt = dt.replace(tzinfo=pytz.timezone(attrs[tz_attr]))
-        else:
-            dt = dt.replace(tzinfo=default_tz or pytz.utc)
-        return dt
+        if codec is None:
+            codec = TimeCodec(default_tz)
+        return codec.read(attrs, attr)
 
     @classmethod
-    def _write_time(cls, elem, dt, name, default_tz=None):
+    def _write_time(cls, elem, dt, name, default_tz=None, codec=None):
         """Records time data into XML element's attributes.
 
         Keyword arguments:
@@ -65,18 +191,16 @@ class XmlBackend(object):
             name -- name for the XML attribute
             default_tz -- default timezone object if a default timezone is
                           defined
+            codec -- the TimeCodec of the document being written; if given,
+                     `default_tz' is ignored in favour of the codec's
 
         """
-        if dt is not None:
-            elem.set(name,
-                     datetime.strftime(dt, session.config['TIME_FORMAT_REPR']))
-            # FIXME: If dt.tzinfo == default_tz, do nothing. (But default_tz
-            # has to be handled yet.)
-            if dt.tzinfo and (default_tz is None or dt.tzinfo != default_tz):
-                elem.set('{}_tz'.format(name), dt.tzname())
+        if codec is None:
+            codec = TimeCodec(default_tz)
+        codec.write(elem, dt, name)
 
     @classmethod
-    def _create_task_e(cls, task, default_tz=None):
+    def _create_task_e(cls, task, default_tz=None, codec=None):
         """Creates an XML element for an object of the type Task."""
         task_e = etree.Element("task",
                                id=str(task.id),
@@ -87,54 +211,141 @@ class XmlBackend(object):
             task_e.set('time', cls._timedelta_repr(task.time))
         if hasattr(task, 'deadline'):
             cls._write_time(task_e, task.deadline, 'deadline',
-                            default_tz=default_tz)
-        if 'prerequisites' in task.__dict__ and task.prerequisites:
-            task_e.set('prerequisites',
-                       ', '.join(map(lambda prereq: prereq.short_repr(),
-                                     task.prerequisites)))
-             # 'enables': {'type': list, 'editable': True},
+                            default_tz=default_tz, codec=codec)
+        prereqs_ref, enables_refs = task_link_refs(task)
+        if prereqs_ref is not None:
+            task_e.set('prerequisites', prereqs_ref)
+        if enables_refs:
+            task_e.set('enables', ', '.join(enables_refs))
         task_e.text = task.name
         return task_e
 
     @classmethod
-    def _create_group_e(cls, group, seen=None):
+    def _create_group_e(cls, group, top=True):
         """Creates an XML element for an object of the type SoeGrouping.
 
+        Groupings that are elements of the grouping are only referred to by
+        empty <group> elements; each grouping is written out on its own (see
+        `_write_tasks_e').
+
         Keyword arguments:
             - group: the SoeGrouping object
-            - seen: a set of group objects that have been seen during the
-                    traversal (only for internal purposes)
+            - top: whether the grouping is one of the top-level groupings
 
         """
-        if seen is None:
-            seen = set()
-        seen.add(group)
-
         group_e = etree.Element("group",
                                 id=str(group.short_repr()),
                                 type=type(group).name)
+        if not top:
+            group_e.set('top', '0')
         for member in group.elems:
-            if isinstance(member, Task):
-                task_e = etree.SubElement(group_e, "task")
-                task_e.set('id', str(member.id))
-            else:
-                assert isinstance(member, SoeGrouping)
+            if isinstance(member, SoeGrouping):
                 assert type(member) != SoeGrouping
-                # If this group was seen previously, do not go into it again.
-                # Else, add it to the set of seen groups and do recur.
-                if member not in seen:
-                    member_e = XmlBackend._create_group_e(member, seen=seen)
-                    group_e.append(member_e)
-                else:
-                    member_e = etree.SubElement(group_e, "group")
-                    member_e.set('id', str(member.short_repr()))
-                    member_e.set('type', type(member).name)
+                etree.SubElement(group_e, "group",
+                                 id=str(member.short_repr()),
+                                 type=type(member).name)
+            else:
+                assert isinstance(member, Task)
+                etree.SubElement(group_e, "task", id=str(member.id))
         return group_e
 
+    # The serialisers below write one element at a time to an incremental
+    # XML writer (etree.xmlfile), so that the memory used does not grow with
+    # the number of tasks and slots written.
+    @classmethod
+    def _write_defaults_e(cls, xf, default_tz):
+        """Writes the <defaults> element, if there are any defaults."""
+        if default_tz is not None:
+            defaults_e = etree.Element('defaults')
+            etree.SubElement(defaults_e, 'timezone').text = str(default_tz)
+            xf.write('\n  ')
+            xf.write(defaults_e)
+
+    @classmethod
+    def _write_tasks_e(cls, xf, tasks, groups, default_tz=None, indent='\n',
+                       outfile=None):
+        """Writes the <tasks> element, with <groups> nested in it.
+
+        All groupings, including nested ones, are written as siblings, each
+        after the groupings it contains, so that the <groups> element never
+        nests deeper than two levels.
+
+        If `outfile' (the file `xf' writes to) is given, returns the pair
+        (offset, length) locating the <groups> element in the file.
+
+        """
+        top_groups = set(map(id, groups))
+        codec = TimeCodec(default_tz)
+        with xf.element('tasks'):
+            for task in tasks:
+                xf.write(indent + '  ')
+                xf.write(cls._create_task_e(task, codec=codec))
+            xf.write(indent + '  ')
+            if outfile is not None:
+                xf.flush()
+                offset = outfile.tell()
+            with xf.element('groups'):
+                for group in topological_order(groups):
+                    xf.write(indent + '    ')
+                    xf.write(cls._create_group_e(
+                        group, top=id(group) in top_groups))
+                xf.write(indent + '  ')
+            if outfile is not None:
+                xf.flush()
+                span = (offset, outfile.tell() - offset)
+            xf.write(indent)
+        return span if outfile is not None else None
+
+    @classmethod
+    def _write_slots_e(cls, xf, slots, extra_slots, default_tz=None,
+                       indent='\n', outfile=None):
+        """Writes the <workslots> element.
+
+        If `outfile' (the file `xf' writes to) is given, returns a list of
+        (offset, length) pairs locating the <workslot> elements in the file,
+        and the serialised elements `extra_slots' are copied to the file as
+        they are.
+
+        """
+        spans = []
+        codec = TimeCodec(default_tz)
+        sep = indent + '  '
+        with xf.element('workslots'):
+            if outfile is None:
+                for slot_e in itertools.chain(
+                        (cls._create_slot_e(slot, codec=codec)
+                         for slot in slots),
+                        (etree.fromstring(data) for data in extra_slots)):
+                    xf.write(sep)
+                    xf.write(slot_e)
+            else:
+                # The file is flushed once per slot, at its end; each slot
+                # starts right after the separator preceding it.
+                sep_data = sep.encode('UTF-8')
+                sep_len = len(sep_data)
+                xf.flush()
+                pos = outfile.tell()
+                for slot in slots:
+                    xf.write(sep)
+                    xf.write(cls._create_slot_e(slot, codec=codec))
+                    xf.flush()
+                    end = outfile.tell()
+                    spans.append((pos + sep_len, end - pos - sep_len))
+                    pos = end
+                # All output of `xf' has been flushed, so extra slots can be
+                # written to the file directly.
+                for data in extra_slots:
+                    outfile.write(sep_data)
+                    outfile.write(data)
+                    spans.append((pos + sep_len, len(data)))
+                    pos += sep_len + len(data)
+            xf.write(indent)
+        return spans
+
     @classmethod
     def write_tasks(cls, tasks, groups, outfile, standalone=True):
         """
-        DEPRECATED!!! In case standalone == False, puts <groups> below <tasks>.
+        DEPRECATED!!! Puts <groups> below <tasks>, as `write_all' does.
 
         Writes out a list of tasks in the XML format to the open file
         `outfile'.
@@ -149,26 +360,33 @@ class XmlBackend(object):
                           the file, including the XML header
 
         """
-        if standalone:
-            top_e = wyrdin_e = etree.Element('wyrdinData')
-            tasks_e = etree.SubElement(wyrdin_e, 'tasks')
-        else:
-            top_e = tasks_e = etree.Element('tasks')
-        for task in tasks:
-            tasks_e.append(cls._create_task_e(task))
-        for group in groups:
-            top_e.append(cls._create_group_e(group))
-        outfile.write(etree.tostring(top_e,
-                                     encoding='UTF-8',
-                                     pretty_print=True,
-                                     xml_declaration=standalone))
+        with etree.xmlfile(outfile, encoding='UTF-8') as xf:
+            if standalone:
+                xf.write_declaration()
+                with xf.element('wyrdinData'):
+                    xf.write('\n  ')
+                    cls._write_tasks_e(xf, tasks, groups, indent='\n  ')
+                    xf.write('\n')
+            else:
+                cls._write_tasks_e(xf, tasks, groups)
+        # The output ends with a newline, as appending to it assumes.
+        outfile.write(b'\n')
 
     @classmethod
-    def read_tasks(cls, infile):
+    def read_tasks(cls, infile, links=None):
+        """Reads tasks from an XML file. Reading stops where the groupings
+        begin.
+
+        Keyword arguments:
+            - infile: an open XML file to read the tasks from
+            - links: if given, a dictionary to fill with references of the
+                     tasks to their prerequisites and the soes they enable,
+                     to be passed to `read_groups'
+
+        """
         tasks = []
-        default_tz = pytz.utc
+        codec = TimeCodec()
         in_tasks = False
-        in_groups = False
         in_defaults = False
         for event, elem in etree.iterparse(infile, events=('start', 'end')):
             if event == 'start':
@@ -177,22 +395,18 @@ class XmlBackend(object):
                 elif elem.tag == 'tasks':
                     in_tasks = True
                     continue
+                # Tasks are all written before groupings.
                 elif elem.tag == 'groups':
-                    in_groups = True
+                    break
 
             # if event == 'end':
             else:
                 if elem.tag == 'defaults':
                     in_defaults = False
-                elif elem.tag == "groups":
-                    in_groups = False
                 # Stop reading as soon as the </tasks> tag is encountered.
                 elif elem.tag == "tasks":
                     break
-                # Skip the subtree describing groupings.
-                if in_groups:
-                    continue
-                elif in_tasks and elem.tag == "task":
+                if in_tasks and elem.tag == "task":
                     # Otherwise, parse each <task> element in accordance to the
                     # way it was output.
                     attrs = elem.attrib
@@ -211,108 +425,134 @@ class XmlBackend(object):
                     if 'time' in attrs:
                         task.time = cls._timedelta_fromrepr(attrs['time'])
                     if 'deadline' in attrs:
-                        task.deadline = cls._read_time(attrs, 'deadline',
-                                                       default_tz=default_tz)
+                        task.deadline = codec.read(attrs, 'deadline')
                     tasks.append(task)
+                    if links is not None:
+                        links[task] = cls._read_task_links(attrs)
                 elif in_defaults and elem.tag == 'timezone':
-                    default_tz = pytz.timezone(elem.text)
+                    codec.default_tz = codec.zone(elem.text)
         return tasks
 
     _typestr2cls = {'and': AndGroup,
                     'or': OrGroup,
                     'list': ListGroup}
 
-    # TODO: It might be advantageous to switch to parsing the XML once into
-    # a tree and reading all from the tree afterwards...
+    @staticmethod
+    def _read_task_links(attrs):
+        """Reads references to prerequisites and enabled soes of a task from
+        attributes of its <task> element, in the form expected by
+        `resolve_task_links'.
+
+        """
+        enables = attrs.get('enables')
+        return (attrs.get('prerequisites'),
+                [ref.strip() for ref in enables.split(',')] if enables else [])
+
+    # Use `read_all' to read tasks, groups and work slots in a single pass
+    # over the file.
     @classmethod
-    def read_groups(cls, infile, tasks):
+    def read_groups(cls, infile, tasks, span=None, links=None):
         """Reads SoeGroupings from an XML file.
 
         Keyword arguments:
+            - infile: an open XML file to read the groupings from
             - tasks: a mapping of known task IDs to the corresponding task
                      objects
-            - infile: an open XML file to read the groupings from
+            - span: the (offset, length) of the <groups> element in the
+                    file, as returned by `write_all'; if given, only the
+                    <groups> element is read, and `links' should be given
+                    too, otherwise the file is parsed from its beginning
+            - links: references of tasks to their prerequisites and the soes
+                     they enable, as filled in by `read_tasks'
 
         """
-        groups = []  # the list of groups to be returned
-        groups_map = {}  # short_repr -> group
-        groups_branch = []  # branch of nested groups currently open
-        in_groups = False
-        for event, elem in etree.iterparse(infile, events=('start', 'end')):
-            # Stop reading as soon as the </groups> tag is encountered.
-            if in_groups:
-                if elem.tag == "groups":
-                    break
-            # Check whether we have reached the <groups> element yet.
-            else:
-                if elem.tag == "groups" and event == "start":
+        reader = _GroupsReader(tasks)
+        links = {} if links is None else links
+        if span is not None:
+            offset, length = span
+            infile.seek(offset)
+            for event, elem in etree.iterparse(
+                    io.BytesIO(infile.read(length)), events=('start', 'end'),
+                    huge_tree=True):
+                if elem.tag != 'groups':
+                    getattr(reader, event)(elem)
+        else:
+            in_groups = False
+            for event, elem in etree.iterparse(
+                    infile, events=('start', 'end'), huge_tree=True):
+                if elem.tag == 'groups':
+                    # Stop reading as soon as the </groups> tag is
+                    # encountered.
+                    if event == 'end':
+                        break
                     in_groups = True
-                continue
-            # Parse each <group> element according to the way it was
-            # output.
-            if elem.tag == "group":
-                if event == "start":
-                    # Open a new group.
-                    grp_type = elem.get('type')
-                    grp_repr = elem.get('id')
-                    if grp_repr in groups_map:
-                        cur_group = groups_map[grp_repr]
-                    else:
-                        cur_group = XmlBackend._typestr2cls[grp_type](
-                            short_repr=grp_repr)
-                        groups_map[grp_repr] = cur_group
-                    # Put the group to its place.
-                    if groups_branch:
-                        groups_branch[-1].elems.append(cur_group)
-                    groups_branch.append(cur_group)
-                # If event == "end",
-                else:
-                    # Close the current group.
-                    if len(groups_branch) == 1:
-                        groups.append(groups_branch[0])
-                    groups_branch.pop()
-            else:
-                assert elem.tag == "task"
-                if event == "start":
-                    task = tasks[int(elem.get('id'))]
-                    groups_branch[-1].elems.append(task)
-        return groups
+                elif in_groups:
+                    getattr(reader, event)(elem)
+                # Links of tasks can refer to groupings, so they are
+                # resolved along with groupings.
+                elif elem.tag == 'task' and event == 'end':
+                    task = tasks.get(int(elem.get('id')))
+                    if task is not None:
+                        links[task] = cls._read_task_links(elem.attrib)
+        resolve_task_links(links, tasks, reader.groups_map)
+        return reader.groups
 
     @classmethod
-    def _create_slot_e(cls, slot, default_tz=None):
+    def _create_slot_e(cls, slot, default_tz=None, codec=None):
         """Creates an XML element for an object of the type WorkSlot."""
+        if codec is None:
+            codec = TimeCodec(default_tz)
         slot_e = etree.Element('workslot',
                                id=str(slot.id),
                                task=str(slot.task.id))
-        cls._write_time(slot_e, slot.start, 'start', default_tz=default_tz)
-        cls._write_time(slot_e, slot.end, 'end', default_tz=default_tz)
+        codec.write(slot_e, slot.start, 'start')
+        codec.write(slot_e, slot.end, 'end')
         return slot_e
 
     @classmethod
     def write_workslots(cls, slots, outfile, standalone=True):
+        """Writes out a list of work slots in the XML format to the open file
+        `outfile', one <workslot> element at a time.
+
+        Keyword arguments:
+            - slots: an iterable of objects of the type WorkSlot
+            - outfile: a file open for writing, to which the slots should be
+                       written
+            - standalone: whether a complete XML content should be written to
+                          the file, including the XML header
+
+        """
         try:
             default_tz = session.config['TIMEZONE']
         except KeyError:
             default_tz = None
-        if standalone:
-            top_e = wyrdin_e = etree.Element('wyrdinData')
-            if default_tz is not None:
-                defaults_e = etree.SubElement(top_e, 'defaults')
-                etree.SubElement(defaults_e, 'timezone').text = str(default_tz)
-            slots_e = etree.SubElement(wyrdin_e, 'workslots')
-        else:
-            top_e = slots_e = etree.Element('workslots')
-        for slot in slots:
-            slots_e.append(cls._create_slot_e(slot, default_tz))
-        outfile.write(etree.tostring(top_e,
-                                     encoding='UTF-8',
-                                     pretty_print=True,
-                                     xml_declaration=standalone))
+        with etree.xmlfile(outfile, encoding='UTF-8') as xf:
+            if standalone:
+                xf.write_declaration()
+                with xf.element('wyrdinData'):
+                    cls._write_defaults_e(xf, default_tz)
+                    xf.write('\n  ')
+                    cls._write_slots_e(xf, slots, (), default_tz,
+                                       indent='\n  ')
+                    xf.write('\n')
+            else:
+                cls._write_slots_e(xf, slots, (), default_tz)
+        # The output ends with a newline, as appending to it assumes.
+        outfile.write(b'\n')
 
     @classmethod
-    def read_workslots(cls, infile):
-        from worktime import WorkSlot
-        default_tz = None
+    def read_workslots(cls, infile, tasks=None):
+        """Reads work slots from an XML file.
+
+        Keyword arguments:
+            - infile: an open XML file to read the work slots from
+            - tasks: a mapping of known task IDs to the corresponding task
+                     objects (default: built from tasks of the session)
+
+        """
+        if tasks is None:
+            tasks = dict((task.id, task) for task in session.tasks)
+        codec = TimeCodec()
         slots = []
         in_defaults = False
         for event, elem in etree.iterparse(infile, events=('start', 'end')):
@@ -328,33 +568,128 @@ class XmlBackend(object):
                 # Otherwise, parse each <workslot> element in accordance to the
                 # way it was output.
                 elif elem.tag == "workslot":
-                    attrs = elem.attrib
-                    id_ = int(attrs['id'])
-                    task_id = int(attrs['task'])
-                    task = session.get_task(task_id)
-                    if 'start' in attrs:
-                        start = cls._read_time(attrs, 'start',
-                                               default_tz=default_tz)
-                    else:
-                        start = None
-                    if 'end' in attrs:
-                        end = cls._read_time(attrs, 'end',
-                                             default_tz=default_tz)
-                    else:
-                        end = None
-                    slot = WorkSlot(task=task, start=start, end=end, id=id_)
-                    slots.append(slot)
+                    slots.append(cls._read_slot(elem.attrib, tasks,
+                                                codec=codec))
                 elif elem.tag == 'timezone' and in_defaults:
-                    default_tz = pytz.timezone(elem.text)
+                    codec.default_tz = codec.zone(elem.text)
         return slots
 
+    @classmethod
+    def _read_slot(cls, attrs, tasks, default_tz=None, codec=None):
+        """Creates a WorkSlot from attributes of its XML element.
+
+        Keyword arguments:
+            - attrs: attributes of the <workslot> element
+            - tasks: a mapping of known task IDs to the corresponding task
+                     objects
+            - default_tz: the default timezone object to use when none was
+                          specified (optional)
+            - codec: the TimeCodec of the document being read; if given,
+                     `default_tz' is ignored in favour of the codec's
+
+        """
+        from worktime import WorkSlot
+        if codec is None:
+            codec = TimeCodec(default_tz)
+        if 'start' in attrs:
+            start = codec.read(attrs, 'start')
+        else:
+            start = None
+        if 'end' in attrs:
+            end = codec.read(attrs, 'end')
+        else:
+            end = None
+        return WorkSlot(task=tasks[int(attrs['task'])],
+                        start=start, end=end, id=int(attrs['id']))
+
+    @classmethod
+    def read_all(cls, infile, read_slots=True):
+        """Reads tasks, groupings, and work slots from an XML file in a single
+        pass.
+
+        Returns a tuple (tasks, groups, slots, defaults), where `defaults' is
+        a dictionary of the default values specified in the file (currently,
+        just 'timezone', if specified).
+
+        Keyword arguments:
+            - infile: an open XML file to read the data from
+            - read_slots: whether to read work slots too; if False, reading
+                          stops as soon as the <workslots> element is
+                          encountered, and the list of slots returned is
+                          empty
+
+        """
+        tasks = []
+        tasks_map = {}  # task ID -> task
+        groups_reader = _GroupsReader(tasks_map)
+        links = {}  # task -> references to its prerequisites and enables
+        slots = []
+        defaults = {}
+        codec = TimeCodec()
+        in_defaults = False
+        in_groups = False
+        for event, elem in etree.iterparse(infile, events=('start', 'end'),
+                                           huge_tree=True):
+            tag = elem.tag
+            if event == 'start':
+                if tag == 'defaults':
+                    in_defaults = True
+                elif tag == 'workslots' and not read_slots:
+                    break
+                elif tag == 'groups':
+                    in_groups = True
+                elif in_groups:
+                    groups_reader.start(elem)
+                continue
+
+            # if event == 'end':
+            if tag == 'defaults':
+                in_defaults = False
+            elif in_defaults:
+                if tag == 'timezone':
+                    codec.default_tz = codec.zone(elem.text)
+                    defaults['timezone'] = codec.default_tz
+            elif tag == 'groups':
+                in_groups = False
+            elif in_groups:
+                groups_reader.end(elem)
+            elif tag == 'task':
+                attrs = elem.attrib
+                task = Task(name=elem.text,
+                            project=attrs.get('project', ''),
+                            id=int(attrs['id']))
+                if 'done' in attrs:
+                    task.done = bool(int(attrs['done']))
+                if 'time' in attrs:
+                    task.time = cls._timedelta_fromrepr(attrs['time'])
+                if 'deadline' in attrs:
+                    task.deadline = codec.read(attrs, 'deadline')
+                tasks.append(task)
+                tasks_map[task.id] = task
+                links[task] = cls._read_task_links(attrs)
+                elem.clear()
+            elif tag == 'workslot':
+                slots.append(cls._read_slot(elem.attrib, tasks_map,
+                                            codec=codec))
+                # Keep the memory footprint of the parse flat.
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        resolve_task_links(links, tasks_map, groups_reader.groups_map)
+        return tasks, groups_reader.groups, slots, defaults
+
     # XXX This name is not the best possible. `all' still does not include
     # projects, just tasks and work slots.
     @classmethod
-    def write_all(cls, tasks, groups, slots, outfile):
+    def write_all(cls, tasks, groups, slots, outfile, extra_slots=()):
         """Writes out a list of tasks and work slots in the XML format to the
         open file `outfile'.
 
+        Returns a pair (groups_span, slot_spans): an (offset, length) pair
+        locating the <groups> element within the data written, and a list of
+        such pairs locating the <workslot> elements, in the order in which
+        the slots were given (`slots' first, `extra_slots' after them).
+
         Keyword arguments:
             - session: the global object for the user session
             - tasks: an iterable of objects of the type Task
@@ -362,26 +697,419 @@ class XmlBackend(object):
             - slots: an iterable of objects of the type WorkSlot
             - outfile: a file open for writing, to which the tasks should be
                        written
+            - extra_slots: an iterable of serialised <workslot> elements to be
+                           copied to the output as they are (used for slots
+                           that have not been loaded into memory)
 
         """
         try:
             default_tz = session.config['TIMEZONE']
         except KeyError:
             default_tz = None
-        wyrdin_e = etree.Element('wyrdinData')
-        if default_tz is not None:
-            defaults_e = etree.SubElement(wyrdin_e, 'defaults')
-            etree.SubElement(defaults_e, 'timezone').text = str(default_tz)
-        tasks_e = etree.SubElement(wyrdin_e, 'tasks')
-        slots_e = etree.SubElement(wyrdin_e, 'workslots')
-        for task in tasks:
-            tasks_e.append(cls._create_task_e(task, default_tz=default_tz))
-        groups_e = etree.SubElement(tasks_e, 'groups')
-        for group in groups:
-            groups_e.append(cls._create_group_e(group))
-        for slot in slots:
-            slots_e.append(cls._create_slot_e(slot, default_tz))
-        outfile.write(etree.tostring(wyrdin_e,
-                                     encoding='UTF-8',
-                                     pretty_print=True,
-                                     xml_declaration=True))
+        with etree.xmlfile(outfile, encoding='UTF-8') as xf:
+            xf.write_declaration()
+            with xf.element('wyrdinData'):
+                cls._write_defaults_e(xf, default_tz)
+                xf.write('\n  ')
+                groups_span = cls._write_tasks_e(xf, tasks, groups,
+                                                 default_tz, indent='\n  ',
+                                                 outfile=outfile)
+                xf.write('\n  ')
+                spans = cls._write_slots_e(xf, slots, extra_slots, default_tz,
+                                           indent='\n  ', outfile=outfile)
+                xf.write('\n')
+        # The output ends with a newline, as appending to it assumes.
+        outfile.write(b'\n')
+        return groups_span, spans
+
+
+class _GroupsReader(object):
+    """Builds groupings from events of parsing a <groups> element.
+
+    A <group> element listing members defines the grouping it names; an empty
+    <group> element only refers to it, possibly before the grouping has been
+    defined. A grouping is defined by the first element listing its members;
+    members listed again by later elements (as older versions wrote shared
+    groupings) are ignored. Groupings nested in <group> elements, as older
+    versions wrote them, are read too.
+
+    Each grouping gets all its members at once, when its element ends, and
+    elements are cleared once read, so that memory used does not grow with
+    the number of groupings.
+
+    """
+    def __init__(self, tasks):
+        """Creates the reader.
+
+        Keyword arguments:
+            - tasks: a mapping of known task IDs to the corresponding task
+                     objects; references to other tasks are dropped
+
+        """
+        self.tasks = tasks
+        self.groups = []  # the list of top-level groups
+        self.groups_map = {}  # short_repr -> group
+        self._defined = set()  # short_reprs of groups defined
+        self._top = set()  # short_reprs of top-level groups
+        # Groups of <group> elements currently open, with the list of their
+        # members if the element defines the group (None otherwise).
+        self._branch = []
+
+    def _add_member(self, member):
+        if self._branch and self._branch[-1][1] is not None:
+            self._branch[-1][1].append(member)
+
+    def start(self, elem):
+        if elem.tag == 'group':
+            grp_repr = elem.get('id')
+            group = self.groups_map.get(grp_repr)
+            if group is None:
+                group = self.groups_map[grp_repr] = \
+                    XmlBackend._typestr2cls[elem.get('type')](
+                        short_repr=grp_repr)
+            self._add_member(group)
+            self._branch.append(
+                (group, None if grp_repr in self._defined else []))
+        else:
+            assert elem.tag == 'task'
+            task = self.tasks.get(int(elem.get('id')))
+            if task is not None:
+                self._add_member(task)
+
+    def end(self, elem):
+        if elem.tag == 'group':
+            group, members = self._branch.pop()
+            grp_repr = elem.get('id')
+            if members:
+                self._defined.add(grp_repr)
+                group.elems = members
+            if (not self._branch and elem.get('top') != '0'
+                    and grp_repr not in self._top):
+                self._top.add(grp_repr)
+                self.groups.append(group)
+        elem.clear()
+        if not self._branch:
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+
+class XmlLogIndex(object):
+    """A sidecar index to <workslot> elements in an XML file. For every work
+    slot, it records its ID, its start and end times as UTC epoch seconds, and
+    the position of its element within the file. This allows for loading only
+    work slots from a given time window, without parsing the whole file.
+
+    The index is stored next to the XML file, with INDEX_SUFFIX appended to
+    its name. It is rebuilt by scanning the XML file whenever it is missing
+    or the XML file has changed since the index was saved.
+
+    Entries are kept column by column, in arrays, in buckets by the length of
+    their slots as in worktime.IntervalIndex, sorted by start within each
+    bucket; entries for slots not ended (or not started) come last. They are
+    stored in the same order, so opening the index does not sort or unpack
+    them, and selecting entries for a time window bisects each bucket.
+
+    """
+    INDEX_SUFFIX = '.idx'
+    slot_rx = re.compile(rb'<workslot\s[^>]*>')
+    _tz_rx = re.compile(rb'<defaults>\s*<timezone>([^<]*)</timezone>')
+    _none = -2 ** 63  # represents None in the packed entries and columns
+    # names of the columns, in the order of values in the packed entries
+    _columns = ('ids', 'starts', 'ends', 'offsets', 'lengths')
+
+    def __init__(self, fname, entries, default_tz=None, groups_span=None,
+                 nloaded=0):
+        """Creates the index.
+
+        Keyword arguments:
+            - fname: path towards the XML file indexed
+            - entries: a list of (id, start, end, offset, length) tuples, one
+                       for each work slot; start and end are UTC epoch
+                       seconds, or None
+            - default_tz: name of the default timezone of the XML file
+            - groups_span: the (offset, length) of the <groups> element in
+                           the XML file, if there is one
+            - nloaded: the number of leading `entries' for slots that have
+                       been loaded already
+
+        """
+        self.fname = fname
+        self.default_tz = default_tz
+        self.groups_span = groups_span
+        self._set_entries(entries, nloaded)
+
+    def _set_entries(self, entries, nloaded=0):
+        """Sets the entries of the index, as passed to the constructor."""
+        def sort_key(idx):
+            start, end = entries[idx][1:3]
+            if start is None or end is None:
+                return (True, 0, 0)
+            return (False, (end - start).bit_length(), start)
+        order = sorted(range(len(entries)), key=sort_key)
+        none = self._none
+        flat = array('q', (none if val is None else val
+                           for idx in order for val in entries[idx]))
+        buckets = []
+        for bucket, group in itertools.groupby(
+                sort_key(idx)[:2] for idx in order):
+            buckets.append((None if bucket[0] else bucket[1],
+                            sum(1 for _ in group)))
+        self._set_columns(flat, buckets)
+        for row, idx in enumerate(order):
+            if idx < nloaded:
+                self._loaded[row] = 1
+        self.nunloaded = len(entries) - nloaded
+
+    def _set_columns(self, flat, buckets):
+        """Sets the columns of the index from the flat array of values of
+        entries (as packed), and the buckets from the list of pairs (bucket,
+        number of entries in it). No entries are marked as loaded.
+
+        """
+        for col, name in enumerate(self._columns):
+            setattr(self, '_' + name, flat[col::len(self._columns)])
+        self._buckets = []  # (bucket, first row, row after the last one)
+        row = 0
+        for bucket, count in buckets:
+            self._buckets.append((bucket, row, row + count))
+            row += count
+        self._loaded = bytearray(len(self._ids))  # row -> whether loaded
+        self.nunloaded = len(self._ids)
+
+    @classmethod
+    def _stat(cls, fname):
+        stat = os.stat(fname)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    @classmethod
+    def _read_header(cls, idx_file, fname):
+        """Reads the header of the index from the open index file. Returns
+        None if the index does not reflect the current XML file `fname', if
+        it was saved by a version not keeping entries in buckets, or if the
+        header is corrupt.
+
+        """
+        try:
+            header = json.loads(idx_file.readline().decode('UTF-8'))
+        except ValueError:
+            return None
+        if header['stat'] != cls._stat(fname) or 'buckets' not in header:
+            return None
+        return header
+
+    @classmethod
+    def stored_groups_span(cls, fname):
+        """Returns the (offset, length) of the <groups> element in the XML
+        file `fname' if an up-to-date index of the file records it, None
+        otherwise. The index is neither built nor read in full.
+
+        """
+        try:
+            with open(fname + cls.INDEX_SUFFIX, 'rb') as idx_file:
+                header = cls._read_header(idx_file, fname)
+        except OSError:
+            return None
+        if header is None or header.get('groups') is None:
+            return None
+        return tuple(header['groups'])
+
+    @classmethod
+    def open(cls, fname):
+        """Returns an up-to-date index for the XML file `fname', building it
+        if necessary.
+
+        """
+        idx_fname = fname + cls.INDEX_SUFFIX
+        if os.path.exists(idx_fname):
+            with open(idx_fname, 'rb') as idx_file:
+                header = cls._read_header(idx_file, fname)
+                flat = array('q')
+                if header is not None:
+                    flat.frombytes(idx_file.read())
+                if (header is not None
+                        and len(flat) == len(cls._columns) * sum(
+                            count for _, count in header['buckets'])):
+                    if sys.byteorder != 'little':
+                        flat.byteswap()
+                    groups_span = header.get('groups')
+                    index = cls(fname, [], header['tz'],
+                                None if groups_span is None
+                                else tuple(groups_span))
+                    index._set_columns(flat, header['buckets'])
+                    return index
+        index = cls.scan(fname)
+        index.save()
+        return index
+
+    @classmethod
+    def scan(cls, fname):
+        """Builds the index by scanning the XML file."""
+        with open(fname, 'rb') as infile:
+            data = infile.read()
+        tz_match = cls._tz_rx.search(data)
+        codec = TimeCodec()
+        if tz_match is not None:
+            default_tz_name = tz_match.group(1).decode('UTF-8').strip()
+            codec.default_tz = codec.zone(default_tz_name)
+        else:
+            default_tz_name = None
+        # Attributes of all slots are collected first, for their times to be
+        # decoded in one batch.
+        ids = []
+        values = []  # start and end time of each slot, alternately
+        zone_names = []
+        present = []  # positions in `values' of times really specified
+        for match in cls.slot_rx.finditer(data):
+            attrs = etree.fromstring(match.group()).attrib
+            ids.append((int(attrs['id']),
+                        match.start(), match.end() - match.start()))
+            for attr in ('start', 'end'):
+                if attr in attrs:
+                    present.append(len(values))
+                    values.append(attrs[attr])
+                    zone_names.append(attrs.get(attr + '_tz'))
+                else:
+                    values.append(None)
+                    zone_names.append(None)
+        epochs = [None] * len(values)
+        for pos, dt in zip(present, codec.decode_many(
+                [values[pos] for pos in present],
+                [zone_names[pos] for pos in present])):
+            epochs[pos] = time_to_epoch(dt)[0]
+        entries = [(slot_id, epochs[2 * idx], epochs[2 * idx + 1],
+                    offset, length)
+                   for idx, (slot_id, offset, length) in enumerate(ids)]
+        groups_span = None
+        groups_start = data.find(b'<groups')
+        if groups_start >= 0:
+            groups_end = data.find(b'</groups>', groups_start)
+            if groups_end >= 0:
+                groups_span = (groups_start,
+                               groups_end + len(b'</groups>') - groups_start)
+        return cls(fname, entries, default_tz_name, groups_span)
+
+    def save(self):
+        """Writes the index next to the XML file."""
+        header = {'stat': self._stat(self.fname), 'tz': self.default_tz,
+                  'groups': self.groups_span,
+                  'buckets': [[bucket, hi - lo]
+                              for bucket, lo, hi in self._buckets]}
+        ncols = len(self._columns)
+        flat = array('q', bytes(8 * ncols * len(self._ids)))
+        for col, name in enumerate(self._columns):
+            flat[col::ncols] = getattr(self, '_' + name)
+        if sys.byteorder != 'little':
+            flat.byteswap()
+        with open_atomic(self.fname + self.INDEX_SUFFIX, 'wb') as idx_file:
+            idx_file.write(json.dumps(header).encode('UTF-8') + b'\n')
+            idx_file.write(flat.tobytes())
+
+    def _time(self, value):
+        return None if value == self._none else value
+
+    def select(self, invl=None):
+        """Returns rows of entries for slots that have not been loaded yet
+        and that intersect the Interval `invl' (all such entries if `invl' is
+        None), in the order of the slots in the XML file.
+
+        """
+        loaded = self._loaded
+        if invl is None:
+            selected = [row for row, flag in enumerate(loaded) if not flag]
+        else:
+            invl_start = time_to_epoch(invl.start)[0]
+            invl_end = time_to_epoch(invl.end)[0]
+            starts, ends = self._starts, self._ends
+            selected = []
+            for bucket, lo, hi in self._buckets:
+                if bucket is None:
+                    selected.extend(
+                        row for row in range(lo, hi)
+                        if not loaded[row]
+                        and (starts[row] == self._none or invl_end is None
+                             or starts[row] <= invl_end)
+                        and (ends[row] == self._none or invl_start is None
+                             or ends[row] >= invl_start))
+                    continue
+                # Slots of the bucket are shorter than 2 ** bucket seconds.
+                if invl_start is not None:
+                    lo = bisect_left(starts, invl_start - 2 ** bucket, lo, hi)
+                if invl_end is not None:
+                    hi = bisect_right(starts, invl_end, lo, hi)
+                selected.extend(row for row in range(lo, hi)
+                                if not loaded[row]
+                                and (invl_start is None
+                                     or ends[row] >= invl_start))
+        selected.sort(key=self._offsets.__getitem__)
+        return selected
+
+    def iter_raw(self, rows):
+        """Yields the serialised <workslot> elements for given rows, reading
+        them from the XML file one at a time.
+
+        """
+        if not rows:
+            return
+        with open(self.fname, 'rb') as infile:
+            for row in rows:
+                infile.seek(self._offsets[row])
+                yield infile.read(self._lengths[row])
+
+    def read_slots(self, tasks, invl=None):
+        """Reads work slots that intersect the Interval `invl' and have not
+        been loaded yet, and marks them as loaded.
+
+        Keyword arguments:
+            - tasks: a mapping of known task IDs to the corresponding task
+                     objects
+            - invl: the time window to read slots from (default: everything)
+
+        """
+        codec = TimeCodec(None if self.default_tz is None
+                          else pytz.timezone(self.default_tz))
+        rows = self.select(invl)
+        slots = [XmlBackend._read_slot(etree.fromstring(slot_data).attrib,
+                                       tasks, codec=codec)
+                 for slot_data in self.iter_raw(rows)]
+        for row in rows:
+            self._loaded[row] = 1
+        self.nunloaded -= len(rows)
+        return slots
+
+    @property
+    def max_id(self):
+        """The maximum ID of any work slot indexed (-1 if there are none)."""
+        return max(self._ids, default=-1)
+
+    def unloaded_ids(self):
+        """Returns the set of IDs of work slots that have not been loaded."""
+        return set(self._ids[row] for row in self.select())
+
+    def write_all(self, tasks, groups, slots, outfile):
+        """Writes out tasks and work slots to the XML file `outfile' and
+        updates the index accordingly. Slots that have not been loaded are
+        copied from the XML file indexed as they are, one at a time, so
+        `outfile' has to be a file other than that one (such as a temporary
+        file to be renamed over it).
+
+        The index has to be saved once the file has been closed.
+
+        Keyword arguments:
+            - tasks, groups, slots, outfile: as for XmlBackend.write_all
+
+        """
+        unloaded = self.select()
+        self.groups_span, spans = XmlBackend.write_all(
+            tasks, groups, slots, outfile,
+            extra_slots=self.iter_raw(unloaded))
+        metas = [(slot.id,
+                  time_to_epoch(slot.start)[0],
+                  time_to_epoch(slot.end)[0]) for slot in slots]
+        metas.extend((self._ids[row], self._time(self._starts[row]),
+                      self._time(self._ends[row])) for row in unloaded)
+        self._set_entries([meta + span for meta, span in zip(metas, spans)],
+                          nloaded=len(slots))
+        try:
+            self.default_tz = str(session.config['TIMEZONE'])
+        except KeyError:
+            self.default_tz = None
@@ -8,7 +8,7 @@ CC-Share Alike 2012 © The Wyrd In team
 https://github.com/WyrdIn
 
 """
-from collections import Mapping
+from collections.abc import Mapping
 
 from nlp.parsers import parse_timedelta, parse_datetime, get_parser
 from task import Task
@@ -255,13 +255,18 @@ class Cli(object):
         print("")
 
     @staticmethod
-    def list_tasks(verbose=False):
+    def list_tasks(verbose=False, actionable=False):
         # TODO Say when the tasks were worked on.
-        print("List of current tasks:")
+        if actionable:
+            print("List of actionable tasks:")
+            tasks = session.find_actionable_tasks()
+        else:
+            print("List of current tasks:")
+            tasks = session.tasks
         if verbose:
             # Remove name, id from slots.
             slots = [slot for slot in Task.slots if slot not in ('id', 'name')]
-            for task in sorted(session.tasks):
+            for task in sorted(tasks):
                 print("    {}".format(task.name))
                 for attr in slots:
                     try:
@@ -272,6 +277,6 @@ class Cli(object):
                           .format(attr=attr, val=val))
                 print("")
         else:
-            for task in sorted(session.tasks):
+            for task in sorted(tasks):
                 print("    {}".format(task))
         print("")
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+# This code is PEP8-compliant. See http://www.python.org/dev/peps/pep-0008/.
+"""
+
+Wyrd In: Time tracker and task manager
+CC-Share Alike 2012 © The Wyrd In team
+https://github.com/WyrdIn
+
+This module keeps the graph of groupings contained in one another acyclic and
+topologically ordered.
+
+Each grouping holds a number, its order, lower than orders of all groupings
+containing it. When a grouping is added to another one, the orders are
+updated using the algorithm of Pearce and Kelly: only groupings whose
+orders lie between those of the two groupings are visited, and they swap
+orders among themselves. The same visit finds out whether the new edge would
+close a cycle.
+
+"""
+import itertools
+
+
+# The source of orders of groupings that have not been ordered yet.
+_new_orders = itertools.count()
+
+
+def order_of(group):
+    """Returns the order of the grouping `group', assigning it one if it has
+    none yet.
+
+    """
+    try:
+        return group._order
+    except AttributeError:
+        order = next(_new_orders)
+        object.__setattr__(group, '_order', order)
+        return order
+
+
+def _subgroups(group):
+    """Returns the groupings that are direct elements of `group'."""
+    from grouping import SoeGrouping
+    return [elem for elem in group.elems if isinstance(elem, SoeGrouping)]
+
+
+def _supergroups(group):
+    """Returns the groupings `group' is a direct element of."""
+    return list(getattr(group, '_parents', {}))
+
+
+def _reach(start, neighbours, within):
+    """Returns the set of groupings reachable from `start' (including it)
+    through `neighbours', passing only through groupings for which `within'
+    is true.
+
+    """
+    reached = {id(start): start}
+    to_visit = [start]
+    while to_visit:
+        for other in neighbours(to_visit.pop()):
+            if id(other) not in reached and within(other):
+                reached[id(other)] = other
+                to_visit.append(other)
+    return reached
+
+
+def add_edge(elem, group):
+    """Records that the grouping `elem' is about to be added to the grouping
+    `group', updating orders of groupings so that `elem' is ordered before
+    `group'.
+
+    Raises ValueError if `group' is `elem' or is contained in it, since
+    the grouping would then contain itself.
+
+    """
+    lower = order_of(group)
+    upper = order_of(elem)
+    if upper < lower:
+        return
+    # Groupings containing `group' that are not ordered after `elem' yet.
+    forward = _reach(group, _supergroups,
+                     lambda other: order_of(other) <= upper)
+    if id(elem) in forward:
+        raise ValueError('The grouping {grp} would contain itself.'.format(
+            grp=elem.short_repr()))
+    # Groupings contained in `elem' that are not ordered before `group' yet.
+    backward = _reach(elem, _subgroups,
+                      lambda other: order_of(other) >= lower)
+    # Reuse the orders of the groupings visited, putting those from
+    # `backward' first and keeping the relative order within each set.
+    moved = (sorted(backward.values(), key=order_of)
+             + sorted(forward.values(), key=order_of))
+    for other, order in zip(moved, sorted(map(order_of, moved))):
+        object.__setattr__(other, '_order', order)
+
+
+def topological_order(groups):
+    """Returns the list of groupings in `groups' and all groupings nested in
+    them, each ordered after all groupings it contains.
+
+    """
+    reached = {}
+    to_visit = list(groups)
+    while to_visit:
+        group = to_visit.pop()
+        if id(group) not in reached:
+            reached[id(group)] = group
+            to_visit.extend(_subgroups(group))
+    return sorted(reached.values(), key=order_of)
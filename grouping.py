@@ -15,10 +15,132 @@ disjunctions.
 import re
 
 from backend.generic import DBObject
+from groupgraph import add_edge, order_of, topological_order
+from util import TrackedList
+
+
+def _link(elem, group):
+    """Records that `elem' is an element of `group'."""
+    parents = getattr(elem, '_parents', None)
+    if parents is None:
+        parents = {}
+        object.__setattr__(elem, '_parents', parents)
+    parents[group] = parents.get(group, 0) + 1
+
+
+def _unlink(elem, group):
+    """Records that one occurrence of `elem' in `group' has been removed."""
+    parents = elem._parents
+    if parents[group] == 1:
+        del parents[group]
+    else:
+        parents[group] -= 1
+
+
+def propagate_done(soe):
+    """Updates the done state cached by groupings containing `soe' after
+    the done state of `soe' has flipped, and so on up the groupings whose
+    done state flips in turn.
+
+    Returns the list of groupings whose done state has flipped.
+
+    """
+    flipped = []
+    # A grouping can flip more than once before its flips are passed on,
+    # so each flip is passed on separately.
+    to_visit = [(soe, 1 if soe.done else -1)]
+    while to_visit:
+        elem, delta = to_visit.pop()
+        for group, count in getattr(elem, '_parents', {}).items():
+            # Groupings which have not computed their state need no update.
+            if group._ndone is None:
+                continue
+            was_done = group.done
+            object.__setattr__(group, '_ndone', group._ndone + delta * count)
+            if group.done != was_done:
+                flipped.append(group)
+                to_visit.append((group, 1 if group.done else -1))
+    return flipped
+
+
+class _Elems(TrackedList):
+    """The list of elements of a grouping.
+
+    Elements added by `append', `extend', `insert' or `+=' and removed by
+    `remove' or `pop' are passed to the grouping, which updates its links and
+    done state for just those elements. Other changes, such as slice
+    assignment, make the grouping compare all of its elements with those
+    before the change.
+
+    """
+    def __init__(self, iterable, group):
+        super().__init__(iterable)
+        self.group = group
+
+    def append(self, elem):
+        self.group._add_edges((elem, ))
+        list.append(self, elem)
+        self.group._elems_added((elem, ))
+
+    def extend(self, elems):
+        elems = list(elems)
+        self.group._add_edges(elems)
+        list.extend(self, elems)
+        self.group._elems_added(elems)
+
+    def insert(self, idx, elem):
+        self.group._add_edges((elem, ))
+        list.insert(self, idx, elem)
+        self.group._elems_added((elem, ))
+
+    def __iadd__(self, elems):
+        self.extend(elems)
+        return self
+
+    def remove(self, elem):
+        self.pop(self.index(elem))
+
+    def pop(self, idx=-1):
+        elem = list.pop(self, idx)
+        self.group._elems_removed((elem, ))
+        return elem
+
+
+def _replacing(name):
+    """Creates a method of _Elems that calls the `list' method `name' and
+    has the grouping compare the elements with those before the call.
+
+    """
+    list_method = getattr(list, name)
+
+    def method(self, *args, **kwargs):
+        old = list(self)
+        ret = list_method(self, *args, **kwargs)
+        self.group._elems_replaced(old)
+        return ret
+    method.__name__ = name
+    method.__doc__ = list_method.__doc__
+    return method
+
+for _name in ('clear', 'sort', 'reverse', '__setitem__', '__delitem__',
+              '__imul__'):
+    setattr(_Elems, _name, _replacing(_name))
+del _name
 
 
 class SoeGrouping(DBObject):
-    """A structured grouping of SOEs -- states or events."""
+    """A structured grouping of SOEs -- states or events.
+
+    The number of elements done is cached, and each element links back to
+    the groupings it is part of, so that when an element becomes done or
+    undone, only the groupings above it are updated (see `propagate_done').
+
+    Groupings cannot contain themselves, not even indirectly; they are kept
+    in a topological order (see the `groupgraph' module).
+
+    """
+    __slots__ = ('_id', '_elems', '_ndone', '_parents', '_order')
+    _derived = ('_elems', '_ndone', '_parents', '_order')
     _id_from_str_rx = re.compile(r'^.*?(\d+)\s*$')  # select the last chunk of
                                                     # digits
 
@@ -44,8 +166,124 @@ class SoeGrouping(DBObject):
         else:
             self.elems = list()
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['elems'] = list(self._elems)
+        return state
+
+    @property
+    def elems(self):
+        return self._elems
+
+    @elems.setter
+    def elems(self, elems):
+        if getattr(self, '_elems', None) is None:
+            object.__setattr__(self, '_elems', _Elems((), self))
+            object.__setattr__(self, '_ndone', None)
+        self._elems[:] = elems
+
+    def _add_edges(self, elems):
+        """Orders the groupings among `elems', which are about to be added to
+        this grouping, before it.
+
+        Raises ValueError if that would make the grouping contain itself.
+
+        """
+        for elem in elems:
+            if isinstance(elem, SoeGrouping):
+                add_edge(elem, self)
+
+    def _update_done(self, elems, sign, nelems_before):
+        """Updates the cached done state after `elems' have been added (for
+        `sign' 1) or removed (for `sign' -1), given the number of elements
+        before the change.
+
+        """
+        if self._ndone is None:
+            return
+        was_done = self._done_for(self._ndone, nelems_before)
+        delta = sign * sum(1 for elem in elems if elem.done)
+        object.__setattr__(self, '_ndone', self._ndone + delta)
+        if self.done != was_done:
+            propagate_done(self)
+
+    def _elems_added(self, elems):
+        """Updates links from elements to this grouping, and the cached done
+        state, after `elems' have been added (and checked by `_add_edges').
+
+        """
+        for elem in elems:
+            _link(elem, self)
+        self._count_modification()
+        self._update_done(elems, 1, len(self._elems) - len(elems))
+
+    def _elems_removed(self, elems):
+        """Updates links from elements to this grouping, and the cached done
+        state, after `elems' have been removed.
+
+        """
+        for elem in elems:
+            _unlink(elem, self)
+        self._count_modification()
+        self._update_done(elems, -1, len(self._elems) + len(elems))
+
+    def _elems_replaced(self, old):
+        """Updates links from elements to this grouping, and the cached done
+        state, after the elements `old' have been replaced by the current
+        ones.
+
+        If the change would make the grouping contain itself, it is undone
+        and ValueError is raised.
+
+        """
+        old_ids = set(map(id, old))
+        try:
+            self._add_edges(elem for elem in self._elems
+                            if id(elem) not in old_ids)
+        except ValueError:
+            list.__setitem__(self._elems, slice(None), old)
+            raise
+        was_done = (None if self._ndone is None
+                    else self._done_for(self._ndone, len(old)))
+        for elem in old:
+            _unlink(elem, self)
+        for elem in self._elems:
+            _link(elem, self)
+        object.__setattr__(self, '_ndone', None)
+        self._count_modification()
+        if was_done is not None and self.done != was_done:
+            propagate_done(self)
+
+    def _count_done(self):
+        """Returns the number of elements done."""
+        if self._ndone is None:
+            # Count for nested groupings not counted yet first, in
+            # topological order, so that deep nesting does not lead to deep
+            # recursion.
+            uncounted = {}
+            to_visit = [self]
+            while to_visit:
+                group = to_visit.pop()
+                if group._ndone is None and id(group) not in uncounted:
+                    uncounted[id(group)] = group
+                    to_visit.extend(elem for elem in group._elems
+                                    if isinstance(elem, SoeGrouping))
+            for group in sorted(uncounted.values(), key=order_of):
+                object.__setattr__(group, '_ndone',
+                                   sum(1 for elem in group._elems
+                                       if elem.done))
+        return self._ndone
+
     @property
     def done(self):
+        return self._done_for(self._count_done(), len(self._elems))
+
+    @staticmethod
+    def _done_for(ndone, nelems):
+        """Tells whether a grouping with `nelems' elements, `ndone' of which
+        are done, is done.
+
+        """
         raise NotImplementedError("The abstract SoeGrouping does not specify "
                                   "when it is done.")
 
@@ -58,11 +296,12 @@ class AndGroup(SoeGrouping):
     for the group to be current.
 
     """
+    __slots__ = ()
     name = "and"
 
-    @property
-    def done(self):
-        return all(map(lambda elem: elem.done, self.elems))
+    @staticmethod
+    def _done_for(ndone, nelems):
+        return ndone == nelems
 
     def short_repr(self):
         return 'ga{id}'.format(id=self.id)
@@ -73,11 +312,12 @@ class OrGroup(SoeGrouping):
     for the group to be current.
 
     """
+    __slots__ = ()
     name = "or"
 
-    @property
-    def done(self):
-        return any(map(lambda elem: elem.done, self.elems))
+    @staticmethod
+    def _done_for(ndone, nelems):
+        return ndone > 0
 
     def short_repr(self):
         return 'go{id}'.format(id=self.id)
@@ -88,7 +328,69 @@ class ListGroup(AndGroup):
     is done, the group is fulfilled (same as AndGroup).
 
     """
+    __slots__ = ()
     name = "list"
 
     def short_repr(self):
         return 'gl{id}'.format(id=self.id)
+
+
+class CompiledGroupings(object):
+    """A flat form of trees of groupings, for evaluating all of the groupings
+    at once.
+
+    Elements of the groupings that are not groupings themselves (tasks, for
+    the most part) and the groupings are numbered, the groupings in
+    topological order -- each after all groupings it contains. Done flags
+    of all of them are kept in one array of bytes, which is filled in
+    a single pass: first the flags of the elements, then, bottom-up, those
+    of the groupings, each grouping looking only at flags of its elements.
+
+    """
+    def __init__(self, groups):
+        """Compiles the groupings `groups' and all groupings nested in
+        them.
+
+        """
+        self.groups = topological_order(groups)
+        self.soes = []  # elements that are not groupings
+        index = {}  # id of an element or grouping -> its number
+        for group in self.groups:
+            for elem in group.elems:
+                if id(elem) not in index and not isinstance(elem,
+                                                            SoeGrouping):
+                    index[id(elem)] = len(self.soes)
+                    self.soes.append(elem)
+        for number, group in enumerate(self.groups, start=len(self.soes)):
+            index[id(group)] = number
+        self._index = index
+        # Each grouping is compiled into a pair (whether all elements need to
+        # be done rather than any, numbers of its elements).
+        self._plan = [(isinstance(group, AndGroup),
+                       tuple(index[id(elem)] for elem in group.elems))
+                      for group in self.groups]
+
+    def evaluate(self):
+        """Computes done flags of all soes and groupings compiled.
+
+        Returns a bytearray holding 1 for those done and 0 for others, at
+        positions given by `number'.
+
+        """
+        nsoes = len(self.soes)
+        flags = bytearray(nsoes + len(self.groups))
+        flags[:nsoes] = bytes(bool(soe.done) for soe in self.soes)
+        get = flags.__getitem__
+        for number, (is_and, elems) in enumerate(self._plan, start=nsoes):
+            if is_and:
+                flags[number] = 0 not in map(get, elems)
+            else:
+                flags[number] = 1 in map(get, elems)
+        return flags
+
+    def number(self, obj):
+        """Returns the number of the soe or grouping `obj', or None if it has
+        not been compiled.
+
+        """
+        return self._index.get(id(obj))
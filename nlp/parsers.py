@@ -15,6 +15,7 @@ import re
 from functools import lru_cache
 
 from datetime import datetime, timedelta, timezone
+from timezones import localize
 from worktime import Interval, dayend, daystart
 from grouping import SoeGrouping
 
@@ -72,7 +73,7 @@ def parse_datetime(dtstr, tz=None, exact=False, orig_val=None, **kwargs):
     # Try to supply the timezone from the original value.
     if (exact_dt.tzinfo is None and orig_val is not None
             and orig_val.tzinfo is not None):
-        exact_dt = exact_dt.replace(tzinfo=orig_val.tzinfo)
+        exact_dt = localize(exact_dt, orig_val.tzinfo)
     # Round out microseconds (that's part of NLP) unless asked to return the
     # exact datetime.
     return exact_dt if exact else exact_dt.replace(microsecond=0)
@@ -144,13 +145,143 @@ def parse_interval(ivalstr, tz=None, exact=False, **kwargs):
     return Interval(start, end)
 
 
-def parse_grouping(grpstr, **kwargs):
-    """Parses a string into a Grouping object."""
-    # Tokenise.
-    tokens = list()
-    # TODO Continue here.
-    raise NotImplementedError('Implement parse_grouping.')
-    len(tokens)
+_grouping_token_rx = re.compile(r'\s*(?:([()\[\],&|])|([a-z]+\d+))',
+                                re.IGNORECASE)
+# (grouping class, IDs of element objects) -> grouping, for groupings built
+# by `parse_grouping', so that repeated subexpressions yield the same grouping
+_grouping_cache = {}
+_GROUPING_CACHE_SIZE = 65536
+
+
+def _tokenise_grouping(grpstr):
+    """Splits a string describing a grouping into tokens -- operators,
+    brackets, and short_reprs of tasks and groupings.
+
+    """
+    tokens = []
+    pos = 0
+    grpstr = grpstr.rstrip()
+    while pos < len(grpstr):
+        rx_match = _grouping_token_rx.match(grpstr, pos)
+        if rx_match is None:
+            raise ValueError('Could not parse grouping from "{arg}": '
+                             'unexpected "{rest}".'.format(
+                                 arg=grpstr, rest=grpstr[pos:].lstrip()))
+        tokens.append(rx_match.group(1) or rx_match.group(2).lower())
+        pos = rx_match.end()
+    return tokens
+
+
+def _resolve_soe(ref):
+    """Returns the task or grouping whose short_repr is `ref', looking it up
+    in the indexes of the session.
+
+    """
+    from wyrdin import session
+    if ref.startswith('t') and ref[1:].isdigit():
+        soe = session.get_task(int(ref[1:]))
+    else:
+        soe = session.get_group(ref)
+    if soe is None:
+        raise ValueError('There is no task or grouping "{ref}".'.format(
+            ref=ref))
+    return soe
+
+
+def _make_grouping(cls, elems):
+    """Returns a grouping of the class `cls' with the elements `elems',
+    reusing one built before if it has not changed since.
+
+    """
+    key = (cls, tuple(map(id, elems)))
+    group = _grouping_cache.get(key)
+    if group is None or tuple(map(id, group.elems)) != key[1]:
+        if len(_grouping_cache) >= _GROUPING_CACHE_SIZE:
+            _grouping_cache.clear()
+        group = _grouping_cache[key] = cls(elems)
+    return group
+
+
+def parse_grouping(grpstr, resolve=None, **kwargs):
+    """Parses a string into a Grouping object.
+
+    The string is an expression built from short_reprs of tasks and
+    groupings (such as `t3' or `ga2'), `&' for conjunctions (AndGroup), `|'
+    for disjunctions (OrGroup), `[..., ...]' for lists (ListGroup), and
+    parentheses. `&' binds more tightly than `|'. For example:
+
+        (t3 & t7) | [t1, t2]
+
+    A single task is turned into a conjunction of just that task.
+
+    Keyword arguments:
+        - grpstr: the string describing the grouping
+        - resolve: a function returning the task or grouping for its
+                   short_repr (default: look it up in the session)
+
+    """
+    from grouping import AndGroup, OrGroup, ListGroup
+    if resolve is None:
+        resolve = _resolve_soe
+    tokens = _tokenise_grouping(grpstr)
+    pos = 0
+
+    def error(expected):
+        found = tokens[pos] if pos < len(tokens) else 'the end'
+        return ValueError('Could not parse grouping from "{arg}": expected '
+                          '{exp}, found "{found}".'.format(
+                              arg=grpstr, exp=expected, found=found))
+
+    def expect(token):
+        nonlocal pos
+        if pos >= len(tokens) or tokens[pos] != token:
+            raise error('"{}"'.format(token))
+        pos += 1
+
+    def parse_chain(parse_operand, operator, cls):
+        elems = [parse_operand()]
+        while pos < len(tokens) and tokens[pos] == operator:
+            expect(operator)
+            elems.append(parse_operand())
+        return elems[0] if len(elems) == 1 else _make_grouping(cls, elems)
+
+    def parse_disj():
+        return parse_chain(parse_conj, '|', OrGroup)
+
+    def parse_conj():
+        return parse_chain(parse_atom, '&', AndGroup)
+
+    def parse_atom():
+        nonlocal pos
+        if pos >= len(tokens):
+            raise error('a task or grouping')
+        token = tokens[pos]
+        if token == '(':
+            expect('(')
+            elem = parse_disj()
+            expect(')')
+            return elem
+        if token == '[':
+            expect('[')
+            elems = []
+            if tokens[pos:pos + 1] != [']']:
+                elems.append(parse_disj())
+                while tokens[pos:pos + 1] == [',']:
+                    expect(',')
+                    elems.append(parse_disj())
+            expect(']')
+            return _make_grouping(ListGroup, elems)
+        if token[0].isalpha():
+            pos += 1
+            return resolve(token)
+        raise error('a task or grouping')
+
+    grouping = parse_disj()
+    if pos < len(tokens):
+        raise error('the end')
+    if not isinstance(grouping, SoeGrouping):
+        grouping = _make_grouping(AndGroup, [grouping])
+    return grouping
 
 
 _type2parser = {datetime: parse_datetime,
@@ -17,7 +17,7 @@ from datetime import datetime, timedelta
 from functools import total_ordering
 
 from backend.generic import DBObject
-from grouping import SoeGrouping
+from grouping import SoeGrouping, propagate_done
 
 
 class Theme(object):
@@ -97,11 +97,14 @@ class Plan(object):
 
 
 class StateOrEvent(DBObject):
-    pass
+    # _parents: groupings this is an element of (see grouping.SoeGrouping)
+    __slots__ = ('_id', '_parents')
+    _derived = ('_parents', )
 
 
 class State(StateOrEvent):
     """This class represents a state of the world in the broadest sense."""
+    __slots__ = ()
 
     def short_repr(self):
         return 's{id}'.format(id=self.id)
@@ -112,6 +115,7 @@ class Event(StateOrEvent):
     sense.
 
     """
+    __slots__ = ('name', 'enables')
     slots = {'id': {'type': int, 'editable': False},
              'name': {'type': str, 'editable': True},
              'enables': {'type': list, 'editable': True},
@@ -144,6 +148,9 @@ class Task(Event):
     # TODO
     #   - make prerequisites structured (a Boolex -- a boolean expression,
     #     built from conjunctions and disjunctions of soes (StateOrEvents))
+    # Optional attributes (time, deadline, prerequisites) are left unset
+    # unless specified.
+    __slots__ = ('project', '_done', 'time', 'deadline', 'prerequisites')
     slots = deepcopy(Event.slots)
     slots.update({'project': {'type': str, 'editable': True},
                   'done': {'type': bool, 'editable': True},
@@ -209,8 +216,21 @@ class Task(Event):
 
     @property
     def done(self):
-        return ('_done' in self.__dict__ and self._done)
+        return getattr(self, '_done', False)
 
     @done.setter
     def done(self, newval):
+        self.set_done(newval)
+
+    def set_done(self, newval):
+        """Sets whether the task has been done.
+
+        Returns the list of groupings whose done state has flipped as
+        a result.
+
+        """
+        was_done = bool(self.done)
         self._done = newval
+        if bool(newval) != was_done:
+            return propagate_done(self)
+        return []
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+#-*- coding: utf-8 -*-
+# This code is PEP8-compliant. See http://www.python.org/dev/peps/pep-0008/.
+"""
+
+Wyrd In: Time tracker and task manager
+CC-Share Alike 2012 © The Wyrd In team
+https://github.com/WyrdIn
+
+This module attaches timezones to naive datetimes, and keeps a cache of
+timezones compiled from the tz database.
+
+Zones from pytz with daylight saving time cannot be attached by
+`dt.replace(tzinfo=zone)', which would give the datetime the zone's first
+offset (usually the local mean time) rather than the one in effect at the
+time. `localize' gives the same results as the zone's `localize' method,
+but faster: for each zone, it remembers the periods of wall time throughout
+which a single offset is in effect, so that localising a time takes a single
+bisection, and only times ambiguous or skipped by a change of the offset are
+passed on to pytz.
+
+"""
+from bisect import bisect_right
+from datetime import datetime
+import marshal
+import os.path
+
+
+_epoch = datetime(1970, 1, 1)
+# Zone -> periods of its wall time with a single offset, as a triple of
+# lists (starts of the periods, their ends, tzinfos in effect).
+_periods = {}
+
+
+def _find_periods(zone):
+    """Returns the periods of wall time of the pytz zone `zone' with
+    a single offset, as stored in `_periods'.
+
+    """
+    starts = []
+    ends = []
+    tzinfos = []
+    trans_times = zone._utc_transition_times
+    trans_info = zone._transition_info
+    for idx, (trans_time, info) in enumerate(zip(trans_times, trans_info)):
+        offset = info[0]
+        # Around a transition, wall times between the old and the new offset
+        # added to the transition time are either ambiguous or skipped.
+        if idx == 0:
+            start = datetime.min
+        else:
+            start = trans_time + max(offset, trans_info[idx - 1][0])
+        if idx + 1 == len(trans_times):
+            end = datetime.max
+        else:
+            end = trans_times[idx + 1] + min(offset, trans_info[idx + 1][0])
+        if start < end:
+            starts.append(start)
+            ends.append(end)
+            tzinfos.append(zone._tzinfos[info])
+    periods = _periods[zone] = (starts, ends, tzinfos)
+    return periods
+
+
+def localize(naive, zone):
+    """Returns the naive datetime `naive' as local time in the timezone
+    `zone'. Times that are ambiguous or that were skipped by a change of the
+    offset are taken as standard time, as pytz does by default.
+
+    """
+    # Zones with a single offset (UTC, for one) can be simply attached.
+    if getattr(zone, '_utc_transition_times', None) is None:
+        return naive.replace(tzinfo=zone)
+    try:
+        starts, ends, tzinfos = _periods[zone]
+    except KeyError:
+        starts, ends, tzinfos = _find_periods(zone)
+    idx = bisect_right(starts, naive) - 1
+    if idx >= 0 and naive < ends[idx]:
+        return naive.replace(tzinfo=tzinfos[idx])
+    return zone.localize(naive)
+
+
+# The cache of compiled timezones.
+#
+# On first use of a timezone, pytz reads and parses its file from the tz
+# database. To spare each run of the program that work, the transition
+# tables of timezones used are marshalled into a cache file, which is
+# loaded into pytz's own cache of timezones, so that pytz.timezone finds the
+# timezones there. The cache is discarded when pytz or the tz database
+# change version.
+
+# Names of timezones loaded from the cache file, or written to it.
+_zones_cached = set()
+
+
+def _db_version():
+    """Returns the version of pytz and the tz database it uses."""
+    import pytz
+    return [pytz.VERSION, pytz.OLSON_VERSION]
+
+
+def _compile_zone(zone):
+    """Returns the data of the pytz timezone `zone' as a value that can be
+    marshalled, or None for timezones that are not built from the tz
+    database.
+
+    """
+    from pytz.tzinfo import DstTzInfo, StaticTzInfo
+    if isinstance(zone, DstTzInfo):
+        return ['dst',
+                [None if trans_time == datetime.min
+                 else int((trans_time - _epoch).total_seconds())
+                 for trans_time in zone._utc_transition_times],
+                [[int(offset.total_seconds()), int(dst.total_seconds()),
+                  tzname]
+                 for offset, dst, tzname in zone._transition_info]]
+    if isinstance(zone, StaticTzInfo):
+        return ['static', int(zone._utcoffset.total_seconds()), zone._tzname]
+    return None
+
+
+def _build_zone(name, data):
+    """Inverse to `_compile_zone': builds the pytz timezone `name' from its
+    data, the way pytz builds it from the tz database.
+
+    """
+    from pytz.tzinfo import (DstTzInfo, StaticTzInfo, memorized_datetime,
+                             memorized_timedelta, memorized_ttinfo)
+    if data[0] == 'static':
+        cls = type(name, (StaticTzInfo, ),
+                   dict(zone=name,
+                        _utcoffset=memorized_timedelta(data[1]),
+                        _tzname=data[2]))
+    else:
+        cls = type(name, (DstTzInfo, ),
+                   dict(zone=name,
+                        _utc_transition_times=[
+                            datetime.min if seconds is None
+                            else memorized_datetime(seconds)
+                            for seconds in data[1]],
+                        _transition_info=[memorized_ttinfo(*info)
+                                          for info in data[2]]))
+    return cls()
+
+
+def load_zone_cache(fname):
+    """Loads timezones from the cache file `fname' into pytz, unless the
+    file does not exist or was written for another version of the tz
+    database.
+
+    """
+    if not os.path.exists(fname):
+        return
+    try:
+        with open(fname, 'rb') as infile:
+            version, zones = marshal.load(infile)
+    except (EOFError, ValueError, TypeError):
+        return
+    if version != _db_version():
+        return
+    import pytz
+    for name, data in zones.items():
+        if name not in pytz._tzinfo_cache:
+            pytz._tzinfo_cache[name] = _build_zone(name, data)
+        _zones_cached.add(name)
+
+
+def save_zone_cache(fname):
+    """Writes all timezones pytz has built so far to the cache file `fname',
+    if any of them is missing from it.
+
+    """
+    import pytz
+    zones = {}
+    for name, zone in pytz._tzinfo_cache.items():
+        data = _compile_zone(zone)
+        if data is not None:
+            zones[name] = data
+    if not zones.keys() - _zones_cached:
+        return
+    from util import open_atomic
+    with open_atomic(fname, 'wb') as outfile:
+        marshal.dump([_db_version(), zones], outfile)
+    _zones_cached.update(zones)
@@ -11,8 +11,63 @@ This module collects rather universal utility functions.
 
 """
 from contextlib import contextmanager
+import os
 import os.path
-from shutil import copy2, move
+import stat
+# shutil and tempfile are imported only when files are written or backed up,
+# which many runs of the program do not do.
+
+
+@contextmanager
+def open_atomic(fname, mode='w', suffix=None, **kwargs):
+    """A context manager for writing a file atomically. The data are written
+    to a temporary file in the same directory, which is synced to the disk
+    and then renamed over the target file. Should an exception be raised, or
+    the program crash, while writing, the original file stays intact.
+
+    Keyword arguments:
+        - fname: path towards the file to be written
+        - mode: mode of opening the file (passed on to open()); has to be
+                a writing mode (default: "w")
+        - suffix: if specified, the previous version of the file is kept
+                  under its name with this suffix appended (hardlinked where
+                  the filesystem supports it, copied otherwise)
+        - further keyword arguments are passed on to open()
+
+    """
+    if not mode.startswith('w'):
+        raise ValueError('open_atomic() can only open files for writing.')
+    import tempfile
+    dirname = os.path.dirname(os.path.abspath(fname))
+    fd, tmp_fname = tempfile.mkstemp(dir=dirname,
+                                     prefix='.' + os.path.basename(fname),
+                                     suffix='.tmp')
+    try:
+        # Give the new file the permissions the original one had.
+        if os.path.exists(fname):
+            os.chmod(tmp_fname, stat.S_IMODE(os.stat(fname).st_mode))
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_fname, 0o666 & ~umask)
+        with open(fd, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if suffix is not None and os.path.exists(fname):
+            bak_fname = fname + suffix
+            if os.path.lexists(bak_fname):
+                os.remove(bak_fname)
+            try:
+                os.link(fname, bak_fname)
+            except OSError:
+                from shutil import copy2
+                copy2(fname, bak_fname)
+        os.replace(tmp_fname, fname)
+    except BaseException:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+        raise
 
 
 @contextmanager
@@ -21,18 +76,26 @@ def open_backed_up(fname, mode='r', suffix='~'):
     raised during manipulating the file, the file is restored from the backup
     before the exception is reraised.
 
+    Files opened for writing from scratch ("w" modes) are written atomically
+    using `open_atomic', keeping the previous version as the backup.
+
     Keyword arguments:
         - fname: path towards the file to be opened
         - mode: mode of opening the file (passed on to open()) (default: "r")
         - suffix: the suffix to use for the backup file (default: "~")
 
     """
+    if mode.startswith('w'):
+        with open_atomic(fname, mode, suffix=suffix) as f:
+            yield f
+        return
     # If the file does not exist, create it.
     if not os.path.exists(fname):
         open(fname, 'w').close()
         bak_fname = None
     # If it does exist, create a backup.
     else:
+        from shutil import copy2
         bak_fname = fname + suffix
         copy2(fname, bak_fname)
     try:
@@ -40,12 +103,55 @@ def open_backed_up(fname, mode='r', suffix='~'):
         yield f
     except Exception as e:
         if bak_fname is not None:
+            from shutil import move
             move(bak_fname, fname)
         raise e
     # Closing.
     f.close()
 
 
+class TrackedList(list):
+    """A list that calls a callback whenever it is modified."""
+
+    def __init__(self, iterable=(), on_change=None):
+        """Creates the list.
+
+        Keyword arguments:
+            - iterable: the initial elements of the list
+            - on_change: a function of no arguments to call after each
+                         modification of the list
+
+        """
+        super().__init__(iterable)
+        self.on_change = on_change
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+
+def _tracking(name):
+    """Creates a method of TrackedList that calls the `list' method `name'
+    and reports the change.
+
+    """
+    list_method = getattr(list, name)
+
+    def method(self, *args, **kwargs):
+        ret = list_method(self, *args, **kwargs)
+        self._changed()
+        return ret
+    method.__name__ = name
+    method.__doc__ = list_method.__doc__
+    return method
+
+for _name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear',
+              'sort', 'reverse', '__setitem__', '__delitem__', '__iadd__',
+              '__imul__'):
+    setattr(TrackedList, _name, _tracking(_name))
+del _name
+
+
 def group_by(objects, attrs, single_attr=False):
     """Groups `objects' by the values of their attributes `attrs'.
 
@@ -71,9 +177,9 @@ def group_by(objects, attrs, single_attr=False):
     groups = dict()
     for obj in objects:
         if single_attr:
-            key = obj.__dict__[attr]
+            key = getattr(obj, attr)
         else:
-            key = tuple(obj.__dict__[attr] for attr in attrs)
+            key = tuple(getattr(obj, attr) for attr in attrs)
         groups.setdefault(key, []).append(obj)
     return groups
 
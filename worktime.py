@@ -11,9 +11,11 @@ https://github.com/WyrdIn
 This module implements classes related to time definitions.
 
 """
-from datetime import datetime, timedelta
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
 
 from backend.generic import DBObject
+from timezones import localize
 
 
 # Constants.
@@ -21,19 +23,59 @@ zero_delta = timedelta()
 
 
 def daystart(dt=lambda: datetime.now(), tz=None):
-    return dt.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=tz)
+    start = dt.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    return start if tz is None else localize(start, tz)
 
 
 def dayend(dt=lambda: datetime.now(), tz=None):
-    return dt.replace(hour=23, minute=59, second=59, microsecond=999999,
-                      tzinfo=tz)
+    end = dt.replace(hour=23, minute=59, second=59, microsecond=999999,
+                     tzinfo=None)
+    return end if tz is None else localize(end, tz)
+
+
+# Times are kept in intervals as whole microseconds since the epoch, UTC.
+_epoch = datetime(1970, 1, 1)
+_epoch_utc = _epoch.replace(tzinfo=timezone.utc)
+_usec = timedelta(microseconds=1)
+
+
+def to_epoch_us(dt):
+    """Returns the datetime `dt' as the number of microseconds since the
+    epoch, taking naive datetimes as UTC. Returns None for None.
+
+    """
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return (dt - _epoch) // _usec
+    return (dt - _epoch_utc) // _usec
+
+
+def from_epoch_us(usecs, tz=None):
+    """Inverse to `to_epoch_us': returns the datetime `usecs' microseconds
+    after the epoch as local time in the timezone `tz' (a naive datetime if
+    `tz' is None). Returns None for None.
+
+    """
+    if usecs is None:
+        return None
+    if tz is None:
+        return _epoch + timedelta(microseconds=usecs)
+    return (_epoch_utc + timedelta(microseconds=usecs)).astimezone(tz)
 
 
 class Interval(object):
     """ Represents a time interval -- not just its length, but also its
     absolute position (start and end times).
 
+    The start and end are kept as microseconds since the epoch (see
+    `to_epoch_us'), exposed as `start_us' and `end_us', along with their
+    timezones. Comparisons and arithmetic on intervals thus work on plain
+    integers; the `start' and `end' datetimes are built only when asked for.
+
     """
+    __slots__ = ('_start', '_end', '_start_tz', '_end_tz',
+                 '_start_dt', '_end_dt')
 
     def __init__(self, start=None, end=None):
         """Initialises the object."""
@@ -41,10 +83,65 @@ class Interval(object):
                 or not (end is None or isinstance(end, datetime))):
             raise TypeError('The `start\' and `end\' arguments have to '
                             'be a `datetime\' instance or None.')
-        if start and end and start > end:
-            raise ValueError('Start must be earlier than end.')
         self.start = start
         self.end = end
+        if (self._start is not None and self._end is not None
+                and self._start > self._end):
+            raise ValueError('Start must be earlier than end.')
+
+    def _set_times_us(self, start_us, start_tz, end_us, end_tz):
+        """Sets the start and end as microseconds since the epoch, each with
+        its timezone (None for naive times).
+
+        """
+        self._start = start_us
+        self._end = end_us
+        object.__setattr__(self, '_start_tz', start_tz)
+        object.__setattr__(self, '_end_tz', end_tz)
+        # The datetimes are built when asked for.
+        for name in ('_start_dt', '_end_dt'):
+            if hasattr(self, name):
+                object.__delattr__(self, name)
+
+    @property
+    def start_us(self):
+        return self._start
+
+    @property
+    def end_us(self):
+        return self._end
+
+    @property
+    def start(self):
+        try:
+            return self._start_dt
+        except AttributeError:
+            start = from_epoch_us(self._start, self._start_tz)
+            object.__setattr__(self, '_start_dt', start)
+            return start
+
+    @start.setter
+    def start(self, start):
+        self._start = to_epoch_us(start)
+        object.__setattr__(self, '_start_tz',
+                           None if start is None else start.tzinfo)
+        object.__setattr__(self, '_start_dt', start)
+
+    @property
+    def end(self):
+        try:
+            return self._end_dt
+        except AttributeError:
+            end = from_epoch_us(self._end, self._end_tz)
+            object.__setattr__(self, '_end_dt', end)
+            return end
+
+    @end.setter
+    def end(self, end):
+        self._end = to_epoch_us(end)
+        object.__setattr__(self, '_end_tz',
+                           None if end is None else end.tzinfo)
+        object.__setattr__(self, '_end_dt', end)
 
     def __str__(self):
         return '{start!s}--{end!s}'.format(start=self.start,
@@ -52,31 +149,34 @@ class Interval(object):
 
     @property
     def length(self):
-        if self.start is None or self.end is None:
+        if self.start_us is None or self.end_us is None:
             return timedelta.max
-        return self.end - self.start
+        return timedelta(microseconds=self.end_us - self.start_us)
 
     @length.setter
     def length(self, newlength):
-        if self.start is None and self.end is None:
+        if self.start_us is None and self.end_us is None:
             raise ValueError('Cannot set the length for an unbound interval.')
-        if self.start is None:
+        if self.start_us is None:
             self.start = self.end - newlength
         else:
             self.end = self.start + newlength
 
     def intersects(self, other):
-        start_after_other_end = (self.start is not None
-                                 and other.end is not None
-                                 and self.start > other.end)
-        end_before_other_start = (self.end is not None
-                                  and other.start is not None
-                                  and self.end < other.start)
+        start, end = self.start_us, self.end_us
+        other_start, other_end = other.start_us, other.end_us
+        start_after_other_end = (start is not None
+                                 and other_end is not None
+                                 and start > other_end)
+        end_before_other_start = (end is not None
+                                  and other_start is not None
+                                  and end < other_start)
         return not start_after_other_end and not end_before_other_start
 
     def includes(self, dt):
-        return (self.start is None or self.start <= dt) and \
-               (self.end is None or self.end >= dt)
+        usecs = to_epoch_us(dt)
+        return ((self.start_us is None or self.start_us <= usecs)
+                and (self.end_us is None or self.end_us >= usecs))
 
     def iscurrent(self, tz=None):
         if tz is None:
@@ -85,6 +185,81 @@ class Interval(object):
             return self.includes(datetime.now(tz))
 
 
+class IntervalIndex(object):
+    """An index of intervals which finds those intersecting a given interval.
+
+    Intervals with both ends bounded are kept in buckets by their length,
+    bucket `j' holding intervals shorter than 2 ** j microseconds (and, for
+    j > 0, not shorter than 2 ** (j - 1) microseconds), sorted by their
+    start. An
+    interval from the bucket `j' that intersects [a, b] has to start within
+    [a - 2 ** j, b], so a query looks just at one run of each bucket. As long
+    as the intervals mostly do not overlap, as is the case with work slots,
+    the query takes O(log n + k) time. Intervals with an unbounded end or
+    start (such as work slots not ended yet) are few and kept aside.
+
+    Intervals are added under a key, by which they can be removed.
+
+    """
+
+    def __init__(self):
+        self._buckets = {}  # j -> (list of starts, list of (end, key, invl))
+        self._unbounded = {}  # key -> interval
+        self._keys = {}  # key -> (bucket, start), bucket None if unbounded
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key, invl):
+        """Adds the interval `invl' to the index under the key `key'."""
+        if key in self._keys:
+            self.remove(key)
+        start = invl.start_us
+        end = invl.end_us
+        if start is None or end is None:
+            self._unbounded[key] = invl
+            self._keys[key] = (None, start)
+            return
+        bucket = (end - start).bit_length()
+        starts, items = self._buckets.setdefault(bucket, ([], []))
+        pos = bisect_right(starts, start)
+        starts.insert(pos, start)
+        items.insert(pos, (end, key, invl))
+        self._keys[key] = (bucket, start)
+
+    def remove(self, key):
+        """Removes the interval added under the key `key' from the index."""
+        bucket, start = self._keys.pop(key)
+        if bucket is None:
+            del self._unbounded[key]
+            return
+        starts, items = self._buckets[bucket]
+        pos = bisect_left(starts, start)
+        while items[pos][1] != key:
+            pos += 1
+        del starts[pos]
+        del items[pos]
+
+    def intersecting(self, invl):
+        """Returns the list of intervals in the index that intersect the
+        Interval `invl' (as tested by Interval.intersects).
+
+        """
+        start = invl.start_us
+        end = invl.end_us
+        found = [other for other in self._unbounded.values()
+                 if other.intersects(invl)]
+        for bucket, (starts, items) in self._buckets.items():
+            lo = 0 if start is None else bisect_left(starts,
+                                                     start - 2 ** bucket)
+            hi = len(starts) if end is None else bisect_right(starts, end)
+            for pos in range(lo, hi):
+                other_end, _, other = items[pos]
+                if start is None or other_end >= start:
+                    found.append(other)
+        return found
+
+
 class WorkSlot(Interval, DBObject):
     """ This shall be a time span (or `timedelta' in Python terminology) with
     the annotation saying how it was spent. It shall link to the relevant task
@@ -94,6 +269,8 @@ class WorkSlot(Interval, DBObject):
     tasks), comments, state of the task before and after this work slot.
 
     """
+    __slots__ = ('_id', 'task')
+    _derived = ('_start_dt', '_end_dt')
 
     def __init__(self, task, start, end=None, id=None):
         """Creates a new work slot.
@@ -112,6 +289,19 @@ class WorkSlot(Interval, DBObject):
         DBObject.__init__(self, id)
         self.task = task
 
+    @classmethod
+    def from_us(cls, task, start_us, start_tz, end_us, end_tz, id=None):
+        """Creates a work slot from its start and end given as microseconds
+        since the epoch, each with its timezone, the way they are kept (see
+        Interval). No datetimes are built until asked for.
+
+        """
+        slot = cls.__new__(cls)
+        slot._set_times_us(start_us, start_tz, end_us, end_tz)
+        DBObject.__init__(slot, id)
+        slot.task = task
+        return slot
+
     def __str__(self):
         return "<WorkSlot: {task}, {invl}>".format(
             task=self.task,
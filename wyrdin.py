@@ -9,6 +9,9 @@ https://github.com/WyrdIn
 
 """
 # Prepare the environment as needed.
+import time
+# The time the program started, for --profile-startup.
+_start_time = time.perf_counter()
 import sys
 import os.path
 # Make sure the libs provided with this package are visible.
@@ -19,13 +22,15 @@ if libs_dirname not in sys.path:
     # the system, `insert' instead of `append'.
     sys.path.append(libs_dirname)
 
-import argparse
-import pytz
+# Modules which take long to import and are not needed by all subcommands
+# (argparse, pytz, parsers, backends, the frontend) are imported only where
+# they are used, so as to start up fast.
 from datetime import datetime, timedelta
-import time
+from functools import wraps
 
-from nlp.parsers import parse_timedelta, parse_interval
-from util import format_timedelta, group_by, open_backed_up
+from backend.generic import id_allocator
+from util import (format_timedelta, group_by, open_atomic, open_backed_up,
+                  TrackedList)
 
 
 # TODO Public fields and methods.
@@ -35,6 +40,10 @@ __all__ = []
 FTYPE_CSV = 0
 FTYPE_PICKLE = 1
 FTYPE_XML = 2
+FTYPE_JOURNAL = 3
+FTYPE_SQLITE = 4
+FTYPE_XML_MONTHLY = 5  # only for the log; the file name is a directory
+FTYPE_SLOTSTORE = 6  # only for the log
 
 # Variables
 session = None
@@ -49,15 +58,95 @@ class ClArgs():
 _cl_args = ClArgs()
 
 
+def _tracked_list(section):
+    """Creates a property for a section of the Session's data that holds
+    a list. Assigning to the property or modifying the list marks the section
+    as modified.
+
+    Containers other than lists that report their modifications themselves
+    through an `on_change' attribute (such as the SlotStore) are held as they
+    are, other values are copied into a TrackedList.
+
+    """
+    attr = '_' + section
+
+    def getter(self):
+        return self.__dict__[attr]
+
+    def setter(self, value):
+        if isinstance(value, list) or not hasattr(value, 'on_change'):
+            value = TrackedList(value)
+        value.on_change = lambda: self._list_changed(section)
+        self.__dict__[attr] = value
+        self._list_changed(section)
+    return property(getter, setter)
+
+
+def _reads(*sections):
+    """Decorates a Session method that reads data into `sections', so that
+    reading itself does not mark them as modified.
+
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            clean = [section for section in sections
+                     if not self.is_dirty(section)]
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.mark_clean(*clean)
+        return wrapper
+    return decorator
+
+
+class _Config(dict):
+    """The configuration of a session. The timezone ('TIMEZONE') is looked
+    up only when first asked for, so that subcommands not dealing with time
+    neither import pytz nor load the cache of timezones.
+
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The name of the timezone to look up (None for UTC).
+        self.tz_name = None
+
+    def __missing__(self, key):
+        if key != 'TIMEZONE':
+            raise KeyError(key)
+        if self.get('TZ_CACHE_FNAME'):
+            from timezones import load_zone_cache
+            load_zone_cache(self['TZ_CACHE_FNAME'])
+        import pytz
+        # TODO Catch UnknownTimeZoneError and raise a ConfigError.
+        tzinfo = self['TIMEZONE'] = pytz.timezone(self.tz_name or 'UTC')
+        return tzinfo
+
+
 class Session(object):
     """
     Represents a user session, gathering such information as current
     configuration or the user's set of tasks.
 
+    The session keeps track of which sections of the data (projects, tasks,
+    groups and wslots) have been modified since they were read or written,
+    so that only those get written out.
+
+    The session also keeps indexes of tasks (by ID and by project) and of
+    work slots (by task, by time, and those open). Adding and removing tasks
+    and work slots through the Session methods keeps the indexes up to date;
+    changing the data any other way makes the indexes be rebuilt when next
+    used.
+
     """
+    projects = _tracked_list('projects')
+    tasks = _tracked_list('tasks')
+    groups = _tracked_list('groups')
+    wslots = _tracked_list('wslots')
+
     def __init__(self):
         # Set the default configuration.
-        self.config = {
+        self.config = _Config({
             'PROJECTS_FNAME': 'projects.lst',
             'TASKS_FNAME_IN': 'tasks.xml',
             'TASKS_FTYPE_IN': FTYPE_XML,
@@ -67,13 +156,42 @@ class Session(object):
             'LOG_FTYPE_IN': FTYPE_XML,
             'LOG_FNAME_OUT': 'tasks.xml',
             'LOG_FTYPE_OUT': FTYPE_XML,
+            # A binary snapshot of the XML file, loaded instead of the XML if
+            # it is up to date. Used only if tasks and the log share the file.
+            # Set to the empty string to disable.
+            'SNAPSHOT_FNAME': 'tasks.snap',
+            # High-water marks of IDs of objects of each type.
+            'IDS_FNAME': 'ids.json',
+            # Timezones compiled from the tz database, kept so as not to
+            # parse the database on each run. Set to the empty string to
+            # disable.
+            'TZ_CACHE_FNAME': 'tz.cache',
             'TIME_FORMAT_USER': '%d %b %Y %H:%M:%S %Z',
             'TIME_FORMAT_REPR': '%Y-%m-%d %H:%M:%S',
-            'TIMEZONE': pytz.utc,
-            # The default timezone for newly specified time data.
+            # The default timezone for newly specified time data,
+            # 'TIMEZONE', is looked up when first used (see _Config).
             'BACKUP_SUFFIX': '~',
-        }
+        })
         # Initialise fields.
+        self._dirty = set()  # sections modified
+        self._clean_mods = {}  # section -> DBObject modifications when clean
+        self._list_changes = {}  # section -> number of changes to its list
+        # Indexes, and the states of data they were built for.
+        self._tasks_by_id = {}  # task ID -> task
+        self._tasks_by_project = {}  # project -> {task ID -> task}
+        # short_repr of a soe or grouping -> {task ID -> task waiting for it}
+        self._dependents = {}
+        self._enablers = {}  # task ID -> {event ID -> event enabling it}
+        self._task_index_stamp = None
+        self._groups_by_repr = {}  # short_repr -> grouping
+        self._group_index_stamp = None
+        self._compiled_groups = None  # grouping.CompiledGroupings
+        self._compiled_groups_stamp = None
+        self._slots_by_task = {}  # task ID -> {slot ID -> slot}
+        self._open_slots = {}  # slot ID -> slot not ended yet
+        # IntervalIndex of slots by slot ID; None if slots are not indexed
+        self._slots_by_time = None
+        self._slot_index_stamp = None
         self.projects = []
         # TODO Devise a more suitable data structure to keep tasks in
         # memory.
@@ -82,6 +200,158 @@ class Session(object):
         self.groups = []
         # Auxiliary variables.
         self._xml_header_written = False
+        # References of tasks read from XML to groupings, to be resolved
+        # when reading groupings.
+        self._task_links = None
+        self._journal = None  # the JournalBackend, if one is used
+        self._sqlite = None  # the SqliteBackend, if one is used
+        # Whether some work slots have been left on disk when reading the log.
+        self._log_partial = False
+        self._log_index = None  # the XmlLogIndex, if one is used
+        self._monthly_log = None  # the XmlMonthlyLog, if one is used
+        self.mark_clean()
+
+    # Sections holding DBObjects -> (module, base class of the objects).
+    _section_classes = {'tasks': ('task', 'StateOrEvent'),
+                        'groups': ('grouping', 'SoeGrouping'),
+                        'wslots': ('worktime', 'WorkSlot')}
+
+    @classmethod
+    def _section_cls(cls, section):
+        """Returns the base class of objects held in the section, or None
+        if the section does not hold DBObjects.
+
+        None is returned also if the module of the class has not been
+        imported yet, so that subcommands not needing the objects do not
+        import it. No objects of the class can have been modified then.
+
+        """
+        if section not in cls._section_classes:
+            return None
+        modname, clsname = cls._section_classes[section]
+        return getattr(sys.modules.get(modname), clsname, None)
+
+    def _list_changed(self, section):
+        self._dirty.add(section)
+        self._list_changes[section] = self._list_changes.get(section, 0) + 1
+
+    def _task_stamp(self):
+        from task import StateOrEvent
+        return (self._list_changes.get('tasks'), StateOrEvent.modifications())
+
+    def _groups_stamp(self):
+        from grouping import SoeGrouping
+        return (self._list_changes.get('groups'), SoeGrouping.modifications())
+
+    def _slot_stamp(self):
+        from worktime import WorkSlot
+        return (self._list_changes.get('wslots'), WorkSlot.modifications())
+
+    @staticmethod
+    def _task_deps(task):
+        """Yields pairs (soe, dependent) for each soe or grouping `task'
+        links to which the task `dependent' waits for.
+
+        """
+        from task import Task
+        prereqs = getattr(task, 'prerequisites', None)
+        if prereqs is not None:
+            yield prereqs, task
+        for soe in getattr(task, 'enables', None) or ():
+            if isinstance(soe, Task):
+                yield task, soe
+
+    def _index_task(self, task):
+        self._tasks_by_id[task.id] = task
+        self._tasks_by_project.setdefault(task.project, {})[task.id] = task
+        for soe, dependent in self._task_deps(task):
+            self._dependents.setdefault(soe.short_repr(),
+                                        {})[dependent.id] = dependent
+            if soe is task:
+                self._enablers.setdefault(dependent.id, {})[task.id] = task
+
+    def _unindex_task(self, task):
+        self._tasks_by_id.pop(task.id, None)
+        self._tasks_by_project.get(task.project, {}).pop(task.id, None)
+        for soe, dependent in self._task_deps(task):
+            self._dependents.get(soe.short_repr(), {}).pop(dependent.id, None)
+            if soe is task:
+                self._enablers.get(dependent.id, {}).pop(task.id, None)
+
+    def _index_slot(self, slot):
+        if self._slots_by_time is None:
+            return
+        self._slots_by_task.setdefault(slot.task.id, {})[slot.id] = slot
+        if slot.end_us is None:
+            self._open_slots[slot.id] = slot
+        self._slots_by_time.add(slot.id, slot)
+
+    def _unindex_slot(self, slot):
+        if self._slots_by_time is None:
+            return
+        self._slots_by_task.get(slot.task.id, {}).pop(slot.id, None)
+        self._open_slots.pop(slot.id, None)
+        self._slots_by_time.remove(slot.id)
+
+    def _task_index(self):
+        """Returns the index of tasks by their IDs, rebuilding the indexes of
+        tasks first if tasks have been changed since they were built.
+
+        """
+        if self._task_index_stamp != self._task_stamp():
+            self._tasks_by_id = {}
+            self._tasks_by_project = {}
+            self._dependents = {}
+            self._enablers = {}
+            for task in self.tasks:
+                self._index_task(task)
+            self._task_index_stamp = self._task_stamp()
+        return self._tasks_by_id
+
+    def _update_slot_index(self):
+        """Rebuilds the indexes of work slots if work slots have been changed
+        since they were built.
+
+        Work slots held in a store other than a list (the SlotStore) are not
+        indexed, as that would create an object for each of them; the store
+        answers the queries from its columns instead.
+
+        """
+        if self._slot_index_stamp != self._slot_stamp():
+            self._slots_by_task = {}
+            self._open_slots = {}
+            self._slots_by_time = None
+            if isinstance(self.wslots, list):
+                from worktime import IntervalIndex
+                self._slots_by_time = IntervalIndex()
+                for slot in self.wslots:
+                    self._index_slot(slot)
+            self._slot_index_stamp = self._slot_stamp()
+
+    def is_dirty(self, section):
+        """Tells whether the section (one of 'projects', 'tasks', 'groups'
+        and 'wslots') has been modified since it was last marked clean, be it
+        by changing the list or by setting attributes of its objects.
+
+        """
+        if section in self._dirty:
+            return True
+        cls = self._section_cls(section)
+        return (cls is not None
+                and cls.modifications() != self._clean_mods.get(section, 0))
+
+    def mark_clean(self, *sections):
+        """Marks the sections given (all sections, if none are given) as not
+        modified.
+
+        """
+        if not sections:
+            sections = ('projects', 'tasks', 'groups', 'wslots')
+        for section in sections:
+            self._dirty.discard(section)
+            cls = self._section_cls(section)
+            self._clean_mods[section] = (0 if cls is None
+                                         else cls.modifications())
 
     def read_config(self, cl_args):
         """ Finds all relevant configuration files, reads them and acts
@@ -100,15 +370,16 @@ class Session(object):
                     # TODO Extend. There can be more various actions to be done
                     # when a value is set in the config file.
                     if cfg_key == 'TIMEZONE':
-                        self.config['TIMEZONE'] = pytz.timezone(cfg_value)
-                        # TODO Catch UnknownTimeZoneError and raise
-                        # a ConfigError.
+                        # The timezone is looked up when first used.
+                        self.config.pop('TIMEZONE', None)
+                        self.config.tz_name = cfg_value
                     elif cfg_key in ('TASKS_FTYPE_IN', 'TASKS_FTYPE_OUT',
                                      'LOG_FTYPE_IN', 'LOG_FTYPE_OUT'):
                         self.config[cfg_key] = int(cfg_value)
                     else:
                         self.config[cfg_key] = cfg_value
 
+    @_reads('projects')
     def read_projects(self, infname=None):
         """
         TODO: Write docstring.
@@ -139,6 +410,7 @@ class Session(object):
             for project in self.projects:
                 outfile.write(project + '\n')
 
+    @_reads('tasks', 'groups')
     def read_tasks(self, infname=None, inftype=None):
         """
         Reads in tasks from files listing the user's tasks. Which files these
@@ -162,8 +434,10 @@ class Session(object):
                 self.tasks = [task for task in taskreader]
         elif inftype == FTYPE_XML:
             from backend.xml import XmlBackend
+            self._task_links = {}
             with open(infname, 'rb') as infile:
-                self.tasks = XmlBackend.read_tasks(infile)
+                self.tasks = XmlBackend.read_tasks(infile,
+                                                   links=self._task_links)
         elif inftype == FTYPE_PICKLE:
             import pickle
             if not os.path.exists(infname):
@@ -237,6 +511,7 @@ class Session(object):
             raise NotImplementedError("Session.write_tasks() is not "
                                       "implemented for this type of files.")
 
+    @_reads('groups')
     def read_groups(self, infname=None, inftype=None):
         # TODO: docstring
         if infname is None:
@@ -246,25 +521,50 @@ class Session(object):
         if not os.path.exists(infname):
             return
         if inftype == FTYPE_XML:
-            from backend.xml import XmlBackend
-            # TODO The tasks_dict used just here is a provisionary solution.
-            tasks_dict = dict()
-            for task in self.tasks:
-                tasks_dict[task.id] = task
+            from backend.xml import XmlBackend, XmlLogIndex
+            # Read just the <groups> element if the index of the file
+            # records where it is and tasks have been read from the file.
+            span = None
+            if self._task_links is not None:
+                span = XmlLogIndex.stored_groups_span(infname)
             with open(infname, 'rb') as infile:
-                self.groups = XmlBackend.read_groups(infile, tasks_dict)
+                self.groups = XmlBackend.read_groups(
+                    infile, self._task_index(), span=span,
+                    links=self._task_links)
+            self._task_links = None
         else:
             raise NotImplementedError("Session.read_groups() is not "
                                       "implemented for this type of files.")
 
-    def read_log(self, infname=None, inftype=None):
-        """Reads the log of how time was spent."""
-        # TODO: Think of when this really has to be done, and when only
-        # a subset of the log needs to be read. In the latter case, allow for
-        # doing so.
+    @_reads('wslots')
+    def read_log(self, infname=None, inftype=None, invl=None,
+                 open_only=False):
+        """Reads the log of how time was spent.
+
+        Work slots that have been read already are not read again, so this
+        method can be called repeatedly to extend the part of the log held in
+        memory.
+
+        Keyword arguments:
+            - infname: path towards the file to read the log from (default:
+                       as configured)
+            - inftype: type of the file (default: as configured)
+            - invl: if specified, only work slots intersecting this Interval
+                    are read, and the rest of the log stays on disk until
+                    asked for (supported for XML, SQLite, and monthly XML
+                    logs; other logs are always read whole)
+            - open_only: if True, only work slots that have not ended yet
+                         need to be read; SQLite logs read just those, the
+                         other logs read slots reaching to the future
+
+        """
         if infname is None:
             infname = self.config['LOG_FNAME_IN']
             inftype = self.config['LOG_FTYPE_IN']
+        if open_only and inftype != FTYPE_SQLITE and invl is None:
+            # Open slots intersect any interval reaching to the future.
+            from worktime import Interval
+            invl = Interval(datetime.now(self.config['TIMEZONE']), None)
         # If no work slots have been written to the file yet, do not load any.
         if not os.path.exists(infname):
             return
@@ -280,14 +580,126 @@ class Session(object):
                         self.wslots.append(worktime)
                     except EOFError:
                         break
-        elif inftype == FTYPE_XML:
+        elif inftype == FTYPE_XML and invl is None and not self._log_partial:
             from backend.xml import XmlBackend
             with open(infname, 'rb') as infile:
                 self.wslots = XmlBackend.read_workslots(infile)
+        elif inftype == FTYPE_XML:
+            from backend.xml import XmlLogIndex
+            from worktime import WorkSlot
+            if self._log_index is None:
+                self._log_index = XmlLogIndex.open(infname)
+                # Make sure new slots do not reuse IDs of slots not loaded.
+                id_allocator.observe(WorkSlot, self._log_index.max_id)
+            tasks_map = self._task_index()
+            self.wslots.extend(self._log_index.read_slots(tasks_map, invl))
+            self._log_partial = self._log_index.nunloaded > 0
+        elif inftype == FTYPE_SQLITE:
+            from backend.sqlite import SqliteBackend
+            from worktime import WorkSlot
+            if self._sqlite is None:
+                self._sqlite = SqliteBackend(infname)
+            if invl is not None or open_only:
+                id_allocator.observe(WorkSlot, self._sqlite.max_slot_id())
+            tasks_map = self._task_index()
+            self.wslots.extend(self._sqlite.read_workslots(
+                tasks_map, invl, open_only=open_only))
+            self._log_partial = not self._sqlite.log_complete
+        elif inftype == FTYPE_XML_MONTHLY:
+            from backend.monthly import XmlMonthlyLog
+            from worktime import WorkSlot
+            if self._monthly_log is None:
+                self._monthly_log = XmlMonthlyLog(
+                    infname, backup_suffix=self.config['BACKUP_SUFFIX'])
+                id_allocator.observe(WorkSlot, self._monthly_log.max_id)
+            tasks_map = self._task_index()
+            self.wslots.extend(self._monthly_log.read_slots(tasks_map, invl))
+            self._log_partial = not self._monthly_log.complete
+        elif inftype == FTYPE_SLOTSTORE:
+            from backend.slotstore import SlotStore
+            from worktime import WorkSlot
+            # Opening the store only maps the file, so the whole log is
+            # always "read".
+            if not (isinstance(self.wslots, SlotStore)
+                    and self.wslots.fname == infname):
+                store = SlotStore(infname, dict(self._task_index()))
+                id_allocator.observe(WorkSlot, store.max_id)
+                self.wslots = store
         else:
             raise NotImplementedError("Session.read_log() is not "
                                       "implemented for this type of files.")
 
+    @_reads('tasks', 'groups', 'wslots')
+    def read_all(self, window=None):
+        """Reads in tasks, task groupings, and work slots from files as
+        dictated by configuration settings.
+
+        If tasks and the log share a single XML file, the file is parsed only
+        once, or not at all if an up-to-date snapshot of it exists (with
+        a window, only tasks and groupings are taken from the snapshot, and
+        work slots are looked up in the index of the XML file). If they
+        share a journal, the journal is replayed. If they share
+        an SQLite database, the database is used.
+
+        Keyword arguments:
+            - window: if specified, only work slots intersecting this
+                      Interval are read (see `read_log')
+
+        """
+        # New objects get IDs above those of any objects stored, even if not
+        # read.
+        id_allocator.open(self.config['IDS_FNAME'])
+        tasks_fname = self.config['TASKS_FNAME_IN']
+        tasks_ftype = self.config['TASKS_FTYPE_IN']
+        if (tasks_ftype == FTYPE_JOURNAL
+                and self.config['LOG_FTYPE_IN'] == FTYPE_JOURNAL
+                and tasks_fname == self.config['LOG_FNAME_IN']):
+            from backend.journal import JournalBackend
+            self._journal = JournalBackend(tasks_fname)
+            self.tasks, self.groups, self.wslots = self._journal.read()
+        elif (tasks_ftype == FTYPE_SQLITE
+                and self.config['LOG_FTYPE_IN'] == FTYPE_SQLITE
+                and tasks_fname == self.config['LOG_FNAME_IN']):
+            from backend.sqlite import SqliteBackend
+            self._sqlite = SqliteBackend(tasks_fname)
+            self.tasks = self._sqlite.read_tasks()
+            self.groups = self._sqlite.read_groups(self._task_index())
+            self.read_log(invl=window)
+        elif (tasks_ftype == FTYPE_XML
+                and self.config['LOG_FTYPE_IN'] == FTYPE_XML
+                and tasks_fname == self.config['LOG_FNAME_IN']):
+            # If nothing has been written yet, don't load anything.
+            if not os.path.exists(tasks_fname):
+                return
+            snapshot_fname = self.config['SNAPSHOT_FNAME']
+            if snapshot_fname:
+                from backend.snapshot import SnapshotBackend
+                if SnapshotBackend.is_fresh(snapshot_fname, tasks_fname):
+                    with open(snapshot_fname, 'rb') as infile:
+                        self.tasks, self.groups, self.wslots = \
+                            SnapshotBackend.read(infile,
+                                                 read_slots=window is None)
+                    if window is not None:
+                        self.read_log(invl=window)
+                    return
+            from backend.xml import XmlBackend
+            with open(tasks_fname, 'rb') as infile:
+                self.tasks, self.groups, self.wslots, _ = \
+                    XmlBackend.read_all(infile, read_slots=window is None)
+            if window is not None:
+                self.read_log(invl=window)
+        else:
+            if tasks_ftype == FTYPE_XML:
+                if os.path.exists(tasks_fname):
+                    from backend.xml import XmlBackend
+                    with open(tasks_fname, 'rb') as infile:
+                        self.tasks, self.groups, _, _ = XmlBackend.read_all(
+                            infile, read_slots=False)
+            else:
+                self.read_tasks()
+                self.read_groups()
+            self.read_log(invl=window)
+
     def write_log(self, outfname=None, outftype=None):
         """TODO: Update docstring."""
         if outfname is None:
@@ -298,6 +710,16 @@ class Session(object):
             with open(outfname, 'wb') as outfile:
                 for wtime in self.wslots:
                     pickle.dump(wtime, outfile)
+        elif outftype == FTYPE_XML_MONTHLY:
+            from backend.monthly import XmlMonthlyLog
+            if self._monthly_log is None:
+                self._monthly_log = XmlMonthlyLog(
+                    outfname, backup_suffix=self.config['BACKUP_SUFFIX'])
+            tasks_map = self._task_index()
+            # Only months holding changed slots are rewritten. Those that
+            # have not been loaded yet get loaded for that purpose.
+            self.wslots.extend(
+                self._monthly_log.write_slots(self.wslots, tasks_map))
         elif outftype == FTYPE_XML:
             from backend.xml import XmlBackend
             # XXX This assumes that `write_log' was called soon after
@@ -315,17 +737,47 @@ class Session(object):
                 if self._xml_header_written:
                     outfile.write(b'</wyrdinData>\n')
                 self._xml_header_written = True
+        elif outftype == FTYPE_SLOTSTORE:
+            from backend.slotstore import SlotStore
+            if (isinstance(self.wslots, SlotStore)
+                    and self.wslots.fname == outfname):
+                # Changes have been made right in the mapped file.
+                self.wslots.flush()
+            else:
+                SlotStore.write(outfname, self.wslots)
         else:
             raise NotImplementedError("Session.write_log() is not "
                                       "implemented for this type of files.")
 
     def write_all(self, tasks_ftype=None, tasks_fname=None,
-                  log_ftype=None, log_fname=None):
+                  log_ftype=None, log_fname=None, force=False):
         """Writes out projects, tasks, task groupings, and working slots to
         files as dictated by configuration settings.
 
+        Only sections modified since they were read are written, so nothing
+        is written (and no backup is made) if nothing has been modified. If
+        tasks and work slots are stored in one file, the file gets written if
+        any of them has been modified.
+
+        Keyword arguments:
+            - force: if True, write everything, even if not modified (use
+                     this when writing to other files than the data were
+                     read from)
+
         """
-        self.write_projects()
+        dirty = set(section
+                    for section in ('projects', 'tasks', 'groups', 'wslots')
+                    if force or self.is_dirty(section))
+        if 'projects' in dirty:
+            self.write_projects()
+        if not dirty.intersection(('tasks', 'groups', 'wslots')):
+            self.mark_clean()
+            return
+        # The timezones cache is updated only along with the data, so that
+        # sessions that changed nothing touch no files.
+        if self.config['TZ_CACHE_FNAME']:
+            from timezones import save_zone_cache
+            save_zone_cache(self.config['TZ_CACHE_FNAME'])
         if tasks_ftype is None:
             tasks_ftype = self.config['TASKS_FTYPE_OUT']
         if log_ftype is None:
@@ -334,51 +786,365 @@ class Session(object):
             tasks_fname = self.config['TASKS_FNAME_OUT']
         if log_fname is None:
             log_fname = self.config['LOG_FNAME_OUT']
-        # The only special case so far.
-        if (tasks_ftype == FTYPE_XML and log_ftype == FTYPE_XML
+        snapshot_fname = (self.config['SNAPSHOT_FNAME']
+                          if (tasks_ftype == FTYPE_XML
+                              and log_ftype == FTYPE_XML
+                              and tasks_fname == log_fname)
+                          else None)
+        # Work slots left on disk can be carried over only to the very same
+        # file, and only by backends that can write the log partially.
+        if self._log_partial and not (
+                log_ftype == self.config['LOG_FTYPE_IN']
+                and log_fname == self.config['LOG_FNAME_IN']
+                and (log_ftype == FTYPE_XML_MONTHLY
+                     or (log_ftype in (FTYPE_XML, FTYPE_SQLITE)
+                         and tasks_ftype == log_ftype
+                         and tasks_fname == log_fname))):
+            self.read_log()
+        if (tasks_ftype == FTYPE_JOURNAL and log_ftype == FTYPE_JOURNAL
                 and tasks_fname == log_fname):
-            from backend.xml import XmlBackend
+            from backend.journal import JournalBackend
+            if self._journal is None or self._journal.fname != tasks_fname:
+                self._journal = JournalBackend(tasks_fname)
+            # Only records for changed objects get appended.
+            self._journal.write(self.tasks, self.groups, self.wslots)
+        elif (tasks_ftype == FTYPE_SQLITE and log_ftype == FTYPE_SQLITE
+                and tasks_fname == log_fname):
+            from backend.sqlite import SqliteBackend
+            if self._sqlite is None or self._sqlite.fname != tasks_fname:
+                self._sqlite = SqliteBackend(tasks_fname)
+            # Only rows for changed objects get written.
+            self._sqlite.write_all(self.tasks, self.groups, self.wslots)
+        elif (tasks_ftype == FTYPE_XML and log_ftype == FTYPE_XML
+                and tasks_fname == log_fname):
+            from backend.xml import XmlLogIndex
+            if self._log_index is None:
+                self._log_index = XmlLogIndex(tasks_fname, [])
+            if snapshot_fname:
+                from backend.snapshot import SnapshotBackend
+                snapshot_slots = self._unloaded_snapshot_slots(
+                    snapshot_fname, tasks_fname)
+            # The new file is written to a temporary file (see
+            # `open_atomic'), so slots not loaded are streamed from the
+            # original file into it, one at a time.
             # TODO: Use the context manager at other places too.
             with open_backed_up(tasks_fname,
                                 'wb',
                                 suffix=self.config['BACKUP_SUFFIX']) \
                     as outfile:
-                XmlBackend.write_all(self.tasks, self.groups, self.wslots,
-                                     outfile)
+                self._log_index.write_all(self.tasks, self.groups,
+                                          self.wslots, outfile)
+            self._log_index.save()
+            if snapshot_fname and snapshot_slots is None:
+                # The snapshot cannot be brought up to date without reading
+                # the whole log, so it is dropped.
+                if os.path.exists(snapshot_fname):
+                    os.remove(snapshot_fname)
+            elif snapshot_fname:
+                with open_atomic(snapshot_fname, 'wb') as outfile:
+                    SnapshotBackend.write(
+                        self.tasks, self.groups, self.wslots, outfile,
+                        SnapshotBackend.source_stat(tasks_fname),
+                        extra_slots=snapshot_slots)
         else:
             # FIXME: The type of file is not looked at, unless the file name is
             # supplied too. Provide some default filename for the supported
             # file types.
-            self.write_log(outftype=log_ftype, outfname=log_fname)
-            self.write_tasks(outftype=tasks_ftype, outfname=tasks_fname)
+            if 'wslots' in dirty:
+                self.write_log(outftype=log_ftype, outfname=log_fname)
+            if dirty.intersection(('tasks', 'groups')):
+                self.write_tasks(outftype=tasks_ftype, outfname=tasks_fname)
+        id_allocator.save()
+        self.mark_clean()
+
+    def _unloaded_snapshot_slots(self, snapshot_fname, xml_fname):
+        """Returns records of the work slots that have not been loaded from
+        the XML file `xml_fname', as stored in the snapshot `snapshot_fname'
+        (see SnapshotBackend.read_slot_records), so that the snapshot can be
+        rewritten without reading them. Returns None if the snapshot does not
+        mirror the XML file.
+
+        """
+        from backend.snapshot import SnapshotBackend
+        if not self._log_partial:
+            return []
+        if not SnapshotBackend.is_fresh(snapshot_fname, xml_fname):
+            return None
+        unloaded_ids = self._log_index.unloaded_ids()
+        with open(snapshot_fname, 'rb') as infile:
+            return [record
+                    for record in SnapshotBackend.read_slot_records(infile)
+                    if record[0] in unloaded_ids]
 
     def find_open_slots(self):
         """Returns work slots that are currently open."""
-        return [slot for slot in self.wslots if slot.end is None]
+        if self._log_partial:
+            self.read_log(open_only=True)
+        self._update_slot_index()
+        if self._slots_by_time is None:
+            return self.wslots.open_slots()
+        return list(self._open_slots.values())
+
+    def find_slots(self, invl):
+        """Returns work slots that intersect the Interval `invl'."""
+        if self._log_partial:
+            self.read_log(invl=invl)
+        self._update_slot_index()
+        if self._slots_by_time is None:
+            return self.wslots.intersecting(invl)
+        return self._slots_by_time.intersecting(invl)
+
+    def get_task(self, task_id):
+        """Returns the task with the ID `task_id', or None if there is no such
+        task.
+
+        """
+        return self._task_index().get(task_id)
+
+    def get_group(self, short_repr):
+        """Returns the grouping with the short_repr `short_repr' from among
+        the session's groupings and groupings nested in them, or None if
+        there is no such grouping.
+
+        """
+        # Groupings never change their short_repr, so a grouping found in an
+        # outdated index is still the right one; the index is rebuilt only
+        # when a grouping is not found.
+        group = self._groups_by_repr.get(short_repr)
+        if group is None and self._group_index_stamp != self._groups_stamp():
+            from groupgraph import topological_order
+            self._groups_by_repr = dict(
+                (group.short_repr(), group)
+                for group in topological_order(self.groups))
+            self._group_index_stamp = self._groups_stamp()
+            group = self._groups_by_repr.get(short_repr)
+        return group
+
+    def get_project_tasks(self, project):
+        """Returns the list of tasks that belong to the project `project'."""
+        self._task_index()
+        return list(self._tasks_by_project.get(project, {}).values())
+
+    def get_task_slots(self, task):
+        """Returns the list of work slots of the task `task'."""
+        if self._log_partial:
+            self.read_log()
+        self._update_slot_index()
+        if self._slots_by_time is None:
+            return self.wslots.task_slots(task)
+        return list(self._slots_by_task.get(task.id, {}).values())
+
+    def _is_actionable(self, task):
+        """Tells whether the task is not done yet while its prerequisites and
+        all the events enabling it are done.
+
+        """
+        if task.done:
+            return False
+        prereqs = getattr(task, 'prerequisites', None)
+        if prereqs is not None and not prereqs.done:
+            return False
+        return all(event.done
+                   for event in self._enablers.get(task.id, {}).values())
+
+    def complete_task(self, task):
+        """Marks the task `task' as done.
+
+        Returns the list of tasks that have become actionable as a result
+        (see `_is_actionable'). Only tasks waiting for `task' itself or for
+        groupings that have become done are looked at, so the cost depends on
+        how many tasks depend on `task', not on the number of all tasks.
+
+        """
+        self._task_index()
+        if task.done:
+            return []
+        # Groupings above the task have to have their done state cached so
+        # that they report flipping.
+        to_visit = [task]
+        seen = set()
+        while to_visit:
+            for group in getattr(to_visit.pop(), '_parents', {}):
+                if group not in seen:
+                    seen.add(group)
+                    group.done
+                    to_visit.append(group)
+        unblocked = {}
+        for soe in [task] + task.set_done(True):
+            if not soe.done:
+                continue
+            for dependent in self._dependents.get(soe.short_repr(),
+                                                  {}).values():
+                if self._is_actionable(dependent):
+                    unblocked[dependent.id] = dependent
+        # Being done does not affect the indexes.
+        self._task_index_stamp = self._task_stamp()
+        return sorted(unblocked.values(), key=lambda task: task.id)
+
+    def _compile_groups(self):
+        """Returns groupings of the session compiled, compiling them anew if
+        they have changed since they were compiled.
+
+        """
+        if self._compiled_groups_stamp != self._groups_stamp():
+            from grouping import CompiledGroupings
+            self._compiled_groups = CompiledGroupings(self.groups)
+            self._compiled_groups_stamp = self._groups_stamp()
+        return self._compiled_groups
+
+    def find_actionable_tasks(self):
+        """Returns the list of all tasks that are actionable (see
+        `_is_actionable').
+
+        Groupings are evaluated all at once in their compiled form, rather
+        than each on its own.
+
+        """
+        self._task_index()
+        compiled = self._compile_groups()
+        flags = compiled.evaluate()
+        actionable = []
+        for task in self.tasks:
+            if task.done:
+                continue
+            prereqs = getattr(task, 'prerequisites', None)
+            if prereqs is not None:
+                number = compiled.number(prereqs)
+                if not (prereqs.done if number is None else flags[number]):
+                    continue
+            if all(event.done
+                   for event in self._enablers.get(task.id, {}).values()):
+                actionable.append(task)
+        return actionable
+
+    def add_task(self, task):
+        self._task_index()
+        self.tasks.append(task)
+        self._index_task(task)
+        self._task_index_stamp = self._task_stamp()
+
+    def add_workslot(self, slot):
+        self._update_slot_index()
+        self.wslots.append(slot)
+        self._index_slot(slot)
+        self._slot_index_stamp = self._slot_stamp()
+
+    def end_workslot(self, slot, end):
+        """Sets the end of the work slot `slot' to `end'."""
+        self._update_slot_index()
+        self._unindex_slot(slot)
+        slot.end = end
+        self._index_slot(slot)
+        self._slot_index_stamp = self._slot_stamp()
 
     def remove_project(self, project):
-        tasks = filter(lambda task: task.project == project, self.tasks)
-        for task in tasks:
-            self.remove_task(task)
+        self._remove_tasks(self.get_project_tasks(project))
         self.projects.remove(project)
 
-    def get_task(self, task_id):
-        return filter(lambda task: task.id == task_id, self.tasks).__next__()
-
     def remove_task(self, task):
-        slots = filter(lambda slot: slot.task == task, self.wslots)
-        for slot in slots:
-            self.remove_workslot(slot)
-        self.tasks.remove(task)
+        self._remove_tasks((task,))
 
     def remove_workslot(self, slot):
-        self.wslots.remove(slot)
+        self._remove_slots((slot,))
+
+    def _remove_tasks(self, tasks):
+        """Removes the tasks `tasks' along with their work slots.
+
+        Tasks are compared by identity, not by equality, so that a task is
+        removed rather than another one of the same name. The lists of tasks
+        and of work slots are rebuilt just once.
+
+        The tasks are also unlinked from the groupings containing them and
+        from the links of other tasks, leaving the session as reading the
+        data back would (which drops references to unknown tasks).
+
+        """
+        if not tasks:
+            return
+        slots = []
+        for task in tasks:
+            slots.extend(self.get_task_slots(task))
+        self._remove_slots(slots)
+        self._task_index()
+        removed = set(id(task) for task in tasks)
+        # Each grouping is rebuilt once; rebuilding it updates its links to
+        # the elements and the done states cached.
+        groups = {}
+        for task in tasks:
+            for group in getattr(task, '_parents', {}):
+                groups[id(group)] = group
+        for group in groups.values():
+            group.elems[:] = [elem for elem in group.elems
+                              if id(elem) not in removed]
+        # Tasks linking to the removed ones: those waiting for them as their
+        # prerequisites, and those enabling them.
+        linking = {}
+        for task in tasks:
+            for dependent in self._dependents.pop(task.short_repr(),
+                                                  {}).values():
+                if getattr(dependent, 'prerequisites', None) is task:
+                    linking[id(dependent)] = dependent
+            for enabler in self._enablers.pop(task.id, {}).values():
+                linking[id(enabler)] = enabler
+        for task in linking.values():
+            if id(task) in removed:
+                continue
+            self._unindex_task(task)
+            if id(getattr(task, 'prerequisites', None)) in removed:
+                task.prerequisites = None
+            if any(id(soe) in removed
+                   for soe in getattr(task, 'enables', None) or ()):
+                task.enables = [soe for soe in task.enables
+                                if id(soe) not in removed]
+            self._index_task(task)
+        for task in tasks:
+            self._unindex_task(task)
+        self.tasks[:] = [task for task in self.tasks
+                         if id(task) not in removed]
+        self._task_index_stamp = self._task_stamp()
+
+    def _remove_slots(self, slots):
+        """Removes the work slots `slots', comparing them by identity."""
+        if not slots:
+            return
+        self._update_slot_index()
+        for slot in slots:
+            self._unindex_slot(slot)
+        if isinstance(self.wslots, list):
+            removed = set(id(slot) for slot in slots)
+            self.wslots[:] = [slot for slot in self.wslots
+                              if id(slot) not in removed]
+        else:
+            # Stores other than lists (the SlotStore) remove rows in place.
+            for slot in slots:
+                self.wslots.remove(slot)
+        self._slot_index_stamp = self._slot_stamp()
+
+
+# Types of arguments, parsed by the natural language parsers. The parsers
+# are imported only when the arguments are given.
+def parse_timedelta(tdstr):
+    from nlp.parsers import parse_timedelta
+    return parse_timedelta(tdstr)
+
+
+def parse_tz_interval(intstr):
+    from nlp.parsers import parse_interval
+    return parse_interval(intstr, tz=session.config['TIMEZONE'])
 
 
 def _init_argparser(arger):
     """
     Initialises the argument parser.
     """
+    arger.add_argument('--profile-startup',
+                       action='store_true',
+                       help="Report how long importing modules and reading "
+                            "data took.")
+    # Sections of data each subcommand needs read. By default, all of them
+    # are, and only the part of the log relevant to current work.
+    arger.set_defaults(needs=('projects', 'tasks', 'groups', 'wslots'),
+                       log_window=_current_window)
     # Create a pool of subcommands.
     subargers = arger.add_subparsers()
     # Subcommands:
@@ -386,7 +1152,7 @@ def _init_argparser(arger):
 
     # help
     arger_help = subargers.add_parser('help', help="Prints out this message.")
-    arger_help.set_defaults(func=print_help)
+    arger_help.set_defaults(func=print_help, needs=())
 
     # begin
     arger_begin = subargers.add_parser('begin',
@@ -428,10 +1194,7 @@ def _init_argparser(arger):
                                         aliases=['s', 'slots'],
                                         help="Prints out the current status "\
                                              "info.")
-    arger_status.set_defaults(func=status)
-    parse_tz_interval = lambda intstr: parse_interval(
-        intstr,
-        tz=session.config['TIMEZONE'])
+    arger_status.set_defaults(func=status, log_window=_status_window)
     arger_status.add_argument('-t', '--time',
                               type=parse_tz_interval,
                               action='append',
@@ -451,14 +1214,14 @@ def _init_argparser(arger):
     arger_proj_a.add_argument('-v', '--verbose',
                               action='store_true',
                               help="Be verbose.")
-    arger_proj_a.set_defaults(func=add_project)
+    arger_proj_a.set_defaults(func=add_project, needs=('projects', ))
     arger_proj_l = proj_subargers.add_parser('list',
                                              aliases=['l', 'ls'],
                                              help="List defined projects.")
     arger_proj_l.add_argument('-v', '--verbose',
                               action='store_true',
                               help="Be verbose.")
-    arger_proj_l.set_defaults(func=list_projects)
+    arger_proj_l.set_defaults(func=list_projects, needs=('projects', ))
     arger_proj_r = proj_subargers.add_parser(
         'remove', aliases=['r', 'rm', 'del'],
         help="Remove an existing project.")
@@ -475,6 +1238,11 @@ def _init_argparser(arger):
     arger_tasks_l.add_argument('-v', '--verbose',
                                action='store_true',
                                help="Be verbose.")
+    arger_tasks_l.add_argument('-a', '--actionable',
+                               action='store_true',
+                               help="List only actionable tasks (not done, "
+                                    "with their prerequisites and enabling "
+                                    "events done).")
     arger_tasks_l.set_defaults(func=list_tasks)
     arger_tasks_a = task_subargers.add_parser('add',
                                               aliases=['a'],
@@ -499,6 +1267,26 @@ def _process_args(arger):
     _cl_args.arger = arger
 
 
+# Parts of the log needed by subcommands.
+def _current_window(args):
+    """Returns the time window covering slots open now or ending later."""
+    from worktime import Interval
+    return Interval(datetime.now(session.config['TIMEZONE']), None)
+
+
+def _status_window(args):
+    """Returns the time window of slots `status' may print, or None if the
+    whole log is needed.
+
+    """
+    if not args.all:
+        return _current_window(args)
+    if args.time:
+        # Slots printed have to intersect each of the intervals.
+        return args.time[0]
+    return None
+
+
 # Subcommand functions.
 def print_help(args):
     args.arger.print_help()
@@ -508,15 +1296,12 @@ def print_help(args):
 def begin(args):
     task = frontend.get_task()
     start = datetime.now(session.config['TIMEZONE']) + args.adjust
-    # TODO Make the Session object take care for accounting related to adding
-    # work slots, tasks etc.
-    session.wslots.append(WorkSlot(task=task, start=start))
-    if task not in session.tasks:
-        session.tasks.append(task)
-        if ('project' in task.__dict__
-                and task.project
+    if session.get_task(task.id) is not task:
+        session.add_task(task)
+        if (task.project
                 and task.project not in session.projects):
             session.projects.append(task.project)
+    session.add_workslot(WorkSlot(task=task, start=start))
     return 0
 
 
@@ -535,41 +1320,49 @@ def end(args):
     # ended.
     else:
         task = frontend.get_task(map(lambda slot: slot.task, open_slots))
-    if args.done:
-        task.done = True
+    unblocked = session.complete_task(task) if args.done else []
     slots_affected = [slot for slot in open_slots if slot.task is task]
     for slot in slots_affected:
-        slot.end = end
+        session.end_workslot(slot, end)
     print("{num} working slot{s} {have} been closed: {task!s}".format(
         num=len(slots_affected),
         s=("" if len(slots_affected) == 1 else "s"),
         have=("has" if len(slots_affected) == 1 else "have"),
         task=task))
+    _report_unblocked(unblocked)
     return 0
 
 
+def _report_unblocked(tasks):
+    """Lets the user know about tasks that can be started now."""
+    for task in tasks:
+        print("Now actionable: {task!s}".format(task=task))
+
+
 def retro(args):
     print("Recording a worktime in retrospect...")
     slot = frontend.get_workslot()
     if args.done:
-        slot.task.done = True
-    session.wslots.append(slot)
+        _report_unblocked(session.complete_task(slot.task))
+    session.add_workslot(slot)
 
 
 def status(args):
-    # Transform selection criteria into test functions.
-    if args.time:
-        filter_time = lambda slot: \
-            all(map(lambda invl: slot.intersects(invl), args.time))
-    else:
-        filter_time = lambda _: True
+    from worktime import Interval, to_epoch_us
+    now = datetime.now(session.config['TIMEZONE'])
+    now_us = to_epoch_us(now)
+    # Slots printed have to intersect each of the intervals.
+    invls = list(args.time or ())
     if not args.all:
-        filter_open = lambda slot: slot.iscurrent()
+        invls.append(Interval(now, now))
+    # Select work slots matching the selection criteria, using the first
+    # interval to look them up.
+    if invls:
+        slots = [slot for slot in session.find_slots(invls[0])
+                 if all(slot.intersects(invl) for invl in invls[1:])]
+        slots.sort(key=lambda slot: slot.id)
     else:
-        filter_open = lambda _: True
-    # Select work slots matching the selection criteria..
-    slots = [slot for slot in session.wslots \
-             if filter_time(slot) and filter_open(slot)]
+        slots = list(session.wslots)
 
     if not slots:
         # FIXME Update the message.
@@ -577,14 +1370,15 @@ def status(args):
     else:
         # FIXME Update the message, especially in case when called with --all.
         print("You have been working on the following tasks:")
-        now = datetime.now(session.config['TIMEZONE'])
         task2slot = group_by(slots, "task", single_attr=True)
         for task in task2slot:
             task_slots = task2slot[task]
             # Expected case: only working once on the task in parallel:
             if len(task_slots) == 1:
-                end = task_slots[0].end or now
-                time_spent = format_timedelta(end - task_slots[0].start)
+                slot = task_slots[0]
+                end_us = now_us if slot.end_us is None else slot.end_us
+                time_spent = format_timedelta(
+                    timedelta(microseconds=end_us - slot.start_us))
                 try:
                     print("\t{time: >18}: {task}".format(task=task.name,
                                                          time=time_spent))
@@ -592,8 +1386,9 @@ def status(args):
                     continue
             else:
                 for slot in task_slots:
-                    end = slot.end or now
-                    time_spent = format_timedelta(end - slot.start)
+                    end_us = now_us if slot.end_us is None else slot.end_us
+                    time_spent = format_timedelta(
+                        timedelta(microseconds=end_us - slot.start_us))
                     print("M\t{time: >18}: {task}".format(task=task.name,
                                                           time=time_spent))
     return 0
@@ -626,13 +1421,13 @@ def remove_project(args):
 
 # Task subcommands
 def list_tasks(args):
-    frontend.list_tasks(args.verbose)
+    frontend.list_tasks(args.verbose, args.actionable)
 
 
 def add_task(args):
     print("Adding a task...")
     task = frontend.get_task()
-    session.tasks.append(task)
+    session.add_task(task)
     print("The task '{}' has been added successfully."\
           .format(str(task).lstrip()))
 
@@ -644,6 +1439,11 @@ def modify_task(args):
     if attr in Task.slots:
         print("Setting {attr} to {val!s}...".format(attr=attr, val=val))
         task.__setattr__(attr, val)
+        # Keep new groupings among the session's ones, so that they get
+        # stored.
+        if (isinstance(val, SoeGrouping)
+                and session.get_group(val.short_repr()) is not val):
+            session.groups.append(val)
         print("The task has been succesfully updated:\n  {task!s}"\
               .format(task=task))
 
@@ -655,11 +1455,48 @@ def remove_task(args):
     print("The task '{}' has been removed successfully.".format(task))
 
 
+class _StartupProfile(object):
+    """Measures how long the phases of starting up take, for the
+    --profile-startup option.
+
+    """
+    def __init__(self, start):
+        """Starts measuring.
+
+        Keyword arguments:
+            - start: the time the program started, as returned by
+                     time.perf_counter()
+
+        """
+        self.start = self.last = start
+        self.phases = []  # pairs (name of the phase, seconds taken)
+
+    def mark(self, phase):
+        """Records that the phase `phase' has just finished."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self, outfile=None):
+        """Prints how long each phase took to `outfile' (stderr by
+        default).
+
+        """
+        if outfile is None:
+            outfile = sys.stderr
+        for phase, secs in self.phases + [('total', self.last - self.start)]:
+            print("{phase: <20}{ms: >9.1f} ms".format(phase=phase,
+                                                     ms=secs * 1000),
+                  file=outfile)
+
+
 # The main program loop.
 if __name__ == "__main__":
     if DEBUG:
         from pprint import pprint
 
+    profile = _StartupProfile(_start_time)
+    profile.mark('imports')
     session = Session()
     # A python gotcha -- the main module gets loaded twice, once as the main
     # module, and second time when imported by other modules. Therefore, any
@@ -669,29 +1506,46 @@ if __name__ == "__main__":
     # globals-and-__main__-a-python-gotcha/.
     import wyrdin
     wyrdin.session = session
+    profile.mark('session')
 
     # Read arguments and configuration, initiate the user session.
+    import argparse
     arger = argparse.ArgumentParser()
     _init_argparser(arger)
     _process_args(arger)
-    session.read_config(_cl_args)
-
-    # Do imports that depend on a configured session.
-    from task import Task
-    from worktime import WorkSlot
+    profile.mark('arguments')
+    # Only the data the subcommand needs are read. Tasks, groupings and the
+    # log are read together, since they can share a file.
+    needs = set(_cl_args.needs)
+    if needs:
+        session.read_config(_cl_args)
+        profile.mark('configuration')
 
     # Read data.
-    session.read_projects()
-    session.read_tasks()
-    session.read_groups()
-    session.read_log()
-
-    from frontend.cli import Cli as frontend
+    if 'projects' in needs:
+        session.read_projects()
+        profile.mark('projects')
+    if needs.intersection(('tasks', 'groups', 'wslots')):
+        # Do imports that depend on a configured session.
+        from grouping import SoeGrouping
+        from task import Task
+        from worktime import WorkSlot
+        session.read_all(window=_cl_args.log_window(_cl_args))
+        profile.mark('tasks and log')
+
+    if needs:
+        from frontend.cli import Cli as frontend
+        profile.mark('frontend')
     # Perform commands.
     # FIXME: As seen, it does not work in a loop yet.
     ret = _cl_args.func(_cl_args)
     if ret == 0:
         print("Done.")
+    profile.mark('command')
 
     # Write data on exit.
-    session.write_all()
+    if needs:
+        session.write_all()
+        profile.mark('writing')
+    if _cl_args.profile_startup:
+        profile.report()